@@ -5,32 +5,136 @@
 # -----------------------------------------------------------------------------
 
 # Import libraries 
+import os
+import tempfile
+from concurrent.futures.process import BrokenProcessPool
 import streamlit as st
 import pandas as pd
 import altair as alt
+from ledger_store import LedgerStore
+from budget_core import (LoadedLedger, sanitize_input, to_compact, to_display,
+                         week_span, month_span, year_span, custom_span, slice_time_span, cube_totals, bar_chart_data, pie_chart_data,
+                         ExportCache, EXPORT_FORMATS, iter_row_chunks)
+from fx_rates import DEFAULT_FX_PATH, FX_BASE_CURRENCY, load_fx_rates, fx_currencies, unconverted_currencies, drop_unconverted
+from statement_import import ParsedStatementCache, make_pool, parse_statements, new_transactions
+from rerun_profiler import RerunProfiler, DEFAULT_LOG_PATH, rerun_table
 
 # set project version
 projectversion = 1.0
 
+# If this environment variable holds a file path, every rerun of every session is measured and logged to that file (e.g. during a load test)
+RERUN_LOG_ENV = os.environ.get("BUDGETBUDDY_RERUN_LOG")
 
-# Define the column order for the finance tracker. "Select" is the first column to facilitate row selection.
-COLS_ORDER = ["Select", "Date", "Name", "Description", "Amount", "Category", "Type", "Currency", "Payment Method", "Project"]
+# If this environment variable holds a file path (e.g. budgetbuddy.db), the ledger is saved in this database file: it is kept after the session ends
+# and all sessions of the app share it, so only set it where you are the only user (e.g. on your own computer).
+# Without it, every session gets its own database in a temporary folder, so the visitors of a hosted app can't see or change each other's data.
+LEDGER_DB_ENV = os.environ.get("BUDGETBUDDY_DB")
 
-# Create a function to sanitize the user input. This function removes commas from user-input strings to prevent issues with CSV formatting.
-def sanitize_input(s):
-    if s is None:
-        return s
-    return s.replace(",", "")
+
+# Create a function to open the database file that all sessions share, together with the cache of its export files.
+# st.cache_resource makes sure both are only created once and shared across reruns and sessions.
+@st.cache_resource
+def get_shared_ledger_files(path):
+    return LedgerStore(path), ExportCache(tempfile.mkdtemp(prefix="budgetbuddy_export_"))
+
+# Create a function to get the ledger database of this session and the cache of its export files (written to a temporary folder until the ledger changes).
+def get_ledger_files():
+    if LEDGER_DB_ENV:
+        return get_shared_ledger_files(LEDGER_DB_ENV)
+    if "ledger_files" not in st.session_state: # a new session starts with its own, empty database
+        folder = tempfile.mkdtemp(prefix="budgetbuddy_session_")
+        st.session_state.ledger_files = (LedgerStore(os.path.join(folder, "budgetbuddy.db")), ExportCache(folder))
+    return st.session_state.ledger_files
+
+def get_store():
+    return get_ledger_files()[0]
+
+def get_export_cache():
+    return get_ledger_files()[1]
+
+# Create functions to get the worker processes that parse uploaded files and the cache of parsed files. Both are created once and shared by all sessions.
+@st.cache_resource
+def get_import_pool():
+    return make_pool()
+
+@st.cache_resource
+def get_parsed_cache():
+    return ParsedStatementCache()
+
+# Create a function to parse uploaded files with the shared worker processes. If a worker process died (e.g. it ran out of memory), the pool can't be
+# used anymore: it is replaced by a new one and the files are parsed once more (the files that were finished before come from the cache).
+def parse_uploaded_files(files, on_progress):
+    try:
+        return parse_statements(files, get_parsed_cache(), get_import_pool(), on_progress=on_progress)
+    except BrokenProcessPool:
+        get_import_pool().shutdown(wait=False, cancel_futures=True)
+        get_import_pool.clear() # the next call starts new worker processes
+        return parse_statements(files, get_parsed_cache(), get_import_pool(), on_progress=on_progress)
+
+# Create a function to read the exchange rates. modified is the modification time of the file, so the file is only read again after it changed.
+@st.cache_resource
+def get_fx_rates(path, modified):
+    return load_fx_rates(path)
+
+# Create a function to mark that the ledger in the database has changed.
+def mark_ledger_changed():
+    st.session_state.editor_version += 1 # rows may have moved, show a fresh table on the next rerun
+
+# Create a function to delete all entries after the user confirmed it. It is called by the "Yes, delete all" button (on_click).
+def reset_ledger():
+    st.session_state.confirm_reset = False
+    get_store().reset() # Delete all entries from the database
+    st.session_state.ledger = LoadedLedger() # Reset the loaded data, the (empty) ledger is loaded again on the next rerun
+    mark_ledger_changed()
+    st.session_state.uploaded_files = [] # Clear any previously uploaded files
+    st.session_state.data_loaded = False # Mark that no data is currently loaded
+    st.session_state.reset_done = True # show a success message on this rerun
+
+# Create a function that saves the changes made in the table. It is called by st.data_editor (on_change), the table reports only the edited,
+# added and deleted rows, so nothing has to be compared or written back on reruns where the table did not change. display_data is the DataFrame the table was showing.
+def on_editor_change(editor_key, display_data):
+    if st.session_state.ledger.is_stale(get_store()): # another session changed the ledger since the table was shown, the positions in the change set may point to other rows now
+        st.session_state.editor_conflict = True # the table edits are not saved, a warning is shown on this rerun
+        st.session_state.editor_version += 1 # show a fresh table with the current rows
+        return
+    with st.session_state.profiler.stage("editor_write_back"): # callbacks run before the script, the stage is counted to the rerun they trigger
+        changed = st.session_state.ledger.apply_editor_changes(st.session_state[editor_key], display_data, get_store())
+    if changed:
+        mark_ledger_changed()
+    else:
+        st.session_state.editor_version += 1 # show a fresh table with the new selection on the next rerun
+
+store = get_store() # the ledger is saved in a database file, the session's own one or the file of BUDGETBUDDY_DB that all sessions share
 
 # We use st.session_state to store data so that it persists across interactions. st.session_state is a special Streamlit feature that remembers values across reruns.
-if "data" not in st.session_state: # Check if "data" does not already exist in st.session_state
-    st.session_state.data = pd.DataFrame(columns=COLS_ORDER) # If not, create it and set it to an empty DataFrame
+# st.session_state.ledger only holds the rows of the years covering the selected time span (sorted by "Date"), their aggregate cube and the selection.
+# The full history stays in the database.
+if "ledger" not in st.session_state: # Check if "ledger" does not already exist in st.session_state
+    st.session_state.ledger = LoadedLedger() # If not, create it, nothing is loaded yet
+
+if "editor_version" not in st.session_state: # part of the key of the table, it changes after the changes of the table were saved
+    st.session_state.editor_version = 0
+
 	
-if "uploaded_file" not in st.session_state: #do the same for "uploaded file"
-    st.session_state.uploaded_file = None
+if "uploaded_files" not in st.session_state: #do the same for "uploaded files"
+    st.session_state.uploaded_files = []
 	
 if "data_loaded" not in st.session_state: #do the same for "data_loaded"
     st.session_state.data_loaded = False
+
+if "confirm_reset" not in st.session_state: # set while the user is asked to confirm the reset of the ledger
+    st.session_state.confirm_reset = False
+
+if "editor_conflict" not in st.session_state: # set when table edits were not saved because the ledger was changed in another session
+    st.session_state.editor_conflict = False
+
+if "profiler" not in st.session_state: # measures the stages of every rerun while "Measure reruns" is switched on
+    st.session_state.profiler = RerunProfiler()
+
+# Start measuring this rerun. The checkboxes of the "Performance" expander keep their values in st.session_state.
+profiler = st.session_state.profiler
+log_path = RERUN_LOG_ENV or (DEFAULT_LOG_PATH if st.session_state.get("log_reruns", False) else None)
+profiler.start(enabled=st.session_state.get("measure_reruns", False) or bool(RERUN_LOG_ENV), log_path=log_path)
 		
 # -----------------------------------------------------------------------------
 # CREATE A SIDEBAR
@@ -50,76 +154,100 @@ with st.sidebar.expander(":clock9: Select Time Span", expanded=False):
         selected_year = st.selectbox("Which Year?", options=range(2000, today.year + 2), index=today.year - 2000)
         selected_week = st.selectbox("Which Week?", options=range(1, 54), index=today.isocalendar().week - 1)
         # Calculate start (Monday) and end (Sunday) dates for that week.
-        start_date = pd.Timestamp.fromisocalendar(selected_year, selected_week, 1) # create a Timestamp from a year, ISO week number and day of the week
-        end_date = pd.Timestamp.fromisocalendar(selected_year, selected_week, 7)
+        start_date, end_date = week_span(selected_year, selected_week) # create Timestamps from a year and ISO week number
 		
     elif time_option == "Month": # check if the user selected "Month". For months, user needs to select a year and a month number
         selected_year = st.selectbox("Which Year?", options=range(2000, today.year + 2), index=today.year - 2000)
         selected_month = st.selectbox("Which Month?", options=list(range(1, 13)), index=today.month - 1)
-        start_date = pd.Timestamp(year=selected_year, month=selected_month, day=1) # create a Timestamp from a year, month and day of the week
-        end_date = start_date + pd.offsets.MonthEnd(1) # add one month to the start date
+        start_date, end_date = month_span(selected_year, selected_month) # first and last day of the month
 		
     elif time_option == "Year": # check if the user selected "Year". For years, user needs to select a year
         selected_year = st.selectbox("Which Year?", options=range(2000, today.year + 2), index=today.year - 2000)
-        start_date = pd.Timestamp(year=selected_year, month=1, day=1) # create a Timestamp from a year, month and day of the week
-        end_date = pd.Timestamp(year=selected_year, month=12, day=31)
+        start_date, end_date = year_span(selected_year) # first and last day of the year
 		
     elif time_option == "Custom": # check if the user selected "Custom". For customs, user needs to select two dates in the datepicker
         custom_range = st.date_input("Which date span?", value=(today - pd.Timedelta(days=7), today))
         if isinstance(custom_range, (list, tuple)) and len(custom_range) == 2: # check if the user selected two dates (checks if the custom_range is a list or tuple)
-            start_date, end_date = pd.to_datetime(custom_range[0]), pd.to_datetime(custom_range[1]) # convert both selected dates into pandas Timestamp objects
+            start_date, end_date = custom_span(custom_range[0], custom_range[1]) # convert both selected dates into pandas Timestamp objects
         else: #display info-message
             st.error(":grey_exclamation: Please select a valid timerange and add an enddate.")
             start_date = today - pd.Timedelta(days=7)
             end_date = today
 
+# create a expander to select the currency the metrics and charts are shown in
+with st.sidebar.expander(":currency_exchange: Reporting Currency", expanded=False):
+    st.write(f":information_source: *Convert the amounts of the metrics and charts into one currency, with the daily exchange rates of the file {DEFAULT_FX_PATH}.*") #write some information
+    fx_rates = None
+    fx_modified = None
+    if os.path.exists(DEFAULT_FX_PATH): # check if there is a rate file
+        try:
+            fx_modified = os.path.getmtime(DEFAULT_FX_PATH)
+            fx_rates = get_fx_rates(DEFAULT_FX_PATH, fx_modified) # read the rates (only again after the file changed)
+        except Exception as e:
+            st.error("Error loading exchange rates: " + str(e)) # inform user about error
+    reporting_currency = None # None: show the amounts as they are
+    if fx_rates is None:
+        st.info(f":grey_exclamation: Add the file {DEFAULT_FX_PATH} with the columns Date, Currency and Rate (value of one unit in {FX_BASE_CURRENCY}) to convert amounts.")
+    else:
+        currency_option = st.selectbox("Show amounts in", options=["Original currencies"] + fx_currencies(fx_rates)) # dropdown with all currencies of the rate file
+        if currency_option != "Original currencies":
+            reporting_currency = currency_option
+
 # create a expander to show different options for data handling (Reset, Upload, Load, and Export)
 with st.sidebar.expander(":card_index_dividers: Data Options", expanded=False):
-    st.write(":information_source: *You can either reset all the data and start with your own or you can import a file.*") #write some information
+    st.write(":information_source: *You can either reset all the data and start with your own or you can import files. Entries that are already in the tracker are skipped.*") #write some information
+    if LEDGER_DB_ENV:
+        st.warning(f":busts_in_silhouette: The ledger is saved in {LEDGER_DB_ENV}, all users of this app share it: changes, imports and a reset apply to everyone's data.") # the database file is shared by all sessions
+    else:
+        st.caption(":lock: Your entries are only visible in this session and are not kept after it ends.") # every session has its own database
 	
-    # Reset Data when a button is clicked
-    if st.button(":wastebasket: Start from scratch and reset data"): #create button
-        st.session_state.data = pd.DataFrame(columns=COLS_ORDER) # Reset the data to an empty DataFrame with the correct column order
-        st.session_state.uploaded_file = None # Clear any previously uploaded file
-        st.session_state.data_loaded = False # Mark that no data is currently loaded
+    # Reset Data when a button is clicked and the reset is confirmed. The buttons use callbacks, so the question is gone on the rerun they trigger.
+    st.button(":wastebasket: Start from scratch and reset data", on_click=lambda: st.session_state.update(confirm_reset=True)) # ask first, the entries can't be restored
+    if st.session_state.confirm_reset:
+        st.warning(":warning: This deletes all entries of the ledger" + (" for every user of this app" if LEDGER_DB_ENV else "") + ". Are you sure?")
+        col_confirm, col_cancel = st.columns(2) # Place the two buttons next to each other
+        col_confirm.button("Yes, delete all", on_click=reset_ledger)
+        col_cancel.button("Cancel", on_click=lambda: st.session_state.update(confirm_reset=False))
+    if st.session_state.pop("reset_done", False):
         st.success("Data reset to an empty dataset.") # Show a success message
 
-    # Upload CSV file when a button is clicked
-    uploaded_file = st.file_uploader("Upload your own CSV", type=["csv"])
-    if uploaded_file is not None: # check if a file was uploaded
-        st.session_state.uploaded_file = uploaded_file #load it into the session.state
+    # Upload CSV files (e.g. one bank statement per month)
+    uploaded_files = st.file_uploader("Upload your own CSV files", type=["csv"], accept_multiple_files=True)
+    if uploaded_files: # check if files were uploaded
+        st.session_state.uploaded_files = uploaded_files #load them into the session.state
 
-    # Load CSV file when a button is clicked
+    # Load the CSV files when a button is clicked. Transactions that are already in the ledger (e.g. from overlapping statements) are skipped.
     if st.button(":outbox_tray: Load CSV into the tracker"):
-        if st.session_state.uploaded_file is not None: # heck if a file was uploaded
+        if st.session_state.uploaded_files: # check if files were uploaded
+            progress_bar = st.progress(0.0, text="Loading CSV...") # show the progress while the files are parsed
             try:
-                df = pd.read_csv(st.session_state.uploaded_file) # set dataframe
-                # check if the uploaded file has all the required columns (excluding "Select")
-                required = set(COLS_ORDER) - {"Select"}
-                missing_cols = [col for col in required if col not in df.columns] # if required column is not in the dataframe, add it to the missing columns
-                if missing_cols:
-                    st.error("CSV is missing required columns: " + ", ".join(missing_cols)) # inform the user about a invalid csv file
-                else: # else everything is good
-                    df["Date"] = pd.to_datetime(df["Date"], errors="coerce") # convert the "Date" column to datetime
-                    df["Amount"] = df["Amount"].astype(str).str.replace(",", "", regex=False).str.replace("'", "", regex=False) # clean up the "Amount" column: convert into string, remove commas/apostrophes
-                    df["Amount"] = pd.to_numeric(df["Amount"], errors="coerce") # after clean up, convert into numeric
-                    mask_expense = df["Type"].str.lower().isin(["expense", "expenses"]) # Create a mask for rows where "Type" is "expense" or "expenses" (case-insensitive).
-                    df.loc[mask_expense, "Amount"] = -df.loc[mask_expense, "Amount"].abs() # Set all expense amounts to negative (force positive first, then negate)
-                    df.loc[~mask_expense & (df["Type"].str.lower() == "income"), "Amount"] = df.loc[~mask_expense & (df["Type"].str.lower() == "income"), "Amount"].abs() # Set all income amounts to positive (force positive).
-                    if "Select" not in df.columns: # If "Select" column doesn't exist, add it with default value False for all rows
-                        df["Select"] = False
-                    df = df[COLS_ORDER] # reorder the dataframe columns to match the predefined order (COLS_ORDER)
-                    st.session_state.data = df # Save the cleaned and processed dataframe into session state
-                    st.session_state.data_loaded = True # Mark that data has been successfully loaded
-                    st.success(":white_check_mark: CSV was loaded successfully!") # inform user about success
+                files = [(file.name, file.getvalue()) for file in st.session_state.uploaded_files] # name and content of every file
+                with profiler.stage("csv_import"):
+                    frames = parse_uploaded_files(files, on_progress=lambda fraction: progress_bar.progress(fraction, text="Loading CSV...")) # parse the files in parallel, files that were parsed before come from the cache
+                with profiler.stage("deduplicate") as stage:
+                    new_rows, skipped = new_transactions(frames, store) # compare the keys of the incoming rows with the stored rows of the same time span
+                    stage.observe(new_rows)
+                with profiler.stage("store_append"):
+                    store.append(new_rows) # Save the new transactions into the database
+                st.session_state.ledger = LoadedLedger() # load the new ledger on the next rerun
+                mark_ledger_changed()
+                st.session_state.data_loaded = True # Mark that data has been successfully loaded
+                st.success(f":white_check_mark: {len(files)} CSV file(s) loaded: {len(new_rows)} new entries, {skipped} duplicates skipped.") # inform user about success
             except Exception as e:
                 st.error("Error loading CSV: " + str(e)) # inform user about error
+            finally:
+                progress_bar.empty() # remove the progress bar once loading is done
         else:
             st.info(":grey_exclamation: Please upload a CSV file first.") # If no file was uploaded, inform the user
 
-    # Export data when a button is clicked
-    csv = st.session_state.data.to_csv(index=False).encode("utf-8") # Convert the session data to CSV format and encode it
-    st.download_button(label=":inbox_tray: Export Data", data=csv, file_name="data_export.csv", mime="text/csv") # Create a download button
+    export_panel = st.container() # the export options are filled in below the time span filter, they can export the rows of the selected time span
+
+# create a expander to measure where the time of a rerun goes
+with st.sidebar.expander(":stopwatch: Performance", expanded=False):
+    st.write(":information_source: *Measure the time, rows and memory of every step of the app. The table shows the last rerun.*") #write some information
+    st.checkbox("Measure reruns", key="measure_reruns", value=bool(RERUN_LOG_ENV), disabled=bool(RERUN_LOG_ENV)) # takes effect from the next rerun on
+    st.checkbox(f"Write measurements to {RERUN_LOG_ENV or DEFAULT_LOG_PATH}", key="log_reruns", value=bool(RERUN_LOG_ENV), disabled=bool(RERUN_LOG_ENV)) # one JSON line per rerun, summarize with: python rerun_profiler.py <file>
+    rerun_panel = st.container() # filled with the measurements at the end of the script
 
 # create a expander to show information about this project
 with st.sidebar.expander(":information_source: About This Project", expanded=False):
@@ -137,26 +265,82 @@ with st.sidebar.expander(":information_source: About This Project", expanded=Fal
 	
     ---
     """)
-    st.write("Please use Streamlit Version 1.45.1 or newer. Your current version is:", st.__version__) #remind user to check fot the current streamlit version installed
+    st.write("Please use Streamlit Version 1.50.0 or newer. Your current version is:", st.__version__) #remind user to check fot the current streamlit version installed
     st.write("Project Version:", projectversion) # display the current version of the app
 		
 # -----------------------------------------------------------------------------
 # MAIN AREA
 # -----------------------------------------------------------------------------
 
+# Load the years covering the selected time span from the database (only if they are not loaded yet, or if another session changed the ledger since they were loaded)
+ledger = st.session_state.ledger
+span_years = (start_date.year, end_date.year)
+if ledger.years != span_years or ledger.is_stale(store):
+    with profiler.stage("load_years") as stage:
+        ledger.load(store, span_years) # read all rows of these years (sorted by date) and aggregate them once, afterwards the cube is only updated by the changes
+        stage.observe(ledger.data)
+
 # Filter data based on time span
-data_all = st.session_state.data.copy() # Make a copy of the main DataFrame to avoid modifying original data
-data_all["Date"] = pd.to_datetime(data_all["Date"], errors="coerce") # Ensure the "Date" column is properly converted to datetime format
-filtered_data = data_all[(data_all["Date"] >= start_date) & (data_all["Date"] <= end_date)] # Filter data to include only rows within the selected date range
+with profiler.stage("filter") as stage:
+    filtered_data, filtered_cube = ledger.visible(start_date, end_date) # Cut out the rows and the daily sums within the selected date range (binary search, no copy, no date parsing)
+    stage.observe(filtered_data)
+
+# Fill the export options of the "Data Options" expander. An export is only written when the user asks for it and the file is reused until the ledger changes.
+with export_panel:
+    export_format = st.selectbox("Export format", options=list(EXPORT_FORMATS)) # CSV, compressed CSV or Parquet
+    export_rows = st.selectbox("Export which entries?", options=["All entries", "Selected time span"]) # the whole ledger or only the visible rows
+    export_scope = ("all",)
+    if export_rows == "Selected time span":
+        export_group_by = st.selectbox("Only one group?", options=["No", "Project", "Payment Method", "Category", "Type", "Currency"]) # optionally narrow the export down to one group
+        export_group = None
+        if export_group_by != "No":
+            export_group = st.selectbox("Which group?", options=sorted(filtered_data[export_group_by].dropna().unique().astype(str)))
+        export_scope = ("span", start_date, end_date, export_group_by, export_group)
+    # The same export of the same ledger version is only written once. The rows of the time span are the loaded rows, so they are keyed by the version
+    # they were loaded at (a change by another session in the meantime gives a new key), the whole ledger is read from the database.
+    export_version = store.version if export_scope[0] == "all" else ledger.store_version
+    export_key = (export_version, export_format, export_scope)
+
+    # Create a function to get the rows of the export in chunks (compact layout). The full ledger is read from the database chunk by chunk.
+    def export_chunks():
+        if export_scope[0] == "all":
+            return store.iter_chunks()
+        chunks = iter_row_chunks(filtered_data) # the rows of the selected time span are already loaded
+        if export_group is not None:
+            chunks = (chunk[chunk[export_group_by].astype(str) == export_group] for chunk in chunks) # keep only the rows of the selected group
+        return chunks
+
+    export_cache = get_export_cache()
+    export_path = export_cache.get(export_key) # None if this export was not written yet
+    if export_path is None and st.button(":package: Prepare export"):
+        with profiler.stage("export"):
+            export_path = export_cache.write(export_key, export_chunks) # convert and write the rows chunk by chunk
+    if export_path is not None:
+        extension, mime = EXPORT_FORMATS[export_format]
+        st.download_button(label=":inbox_tray: Export Data", data=export_path.read_bytes, file_name="data_export" + extension, mime=mime) # Create a download button, the file is only read when it is clicked
+
+# Convert the daily sums into the reporting currency. The metrics and charts use report_cube, the table keeps the original amounts.
+report_cube = filtered_cube
+currency_label = "" # shown after the amounts of the metrics
+if reporting_currency is not None:
+    with profiler.stage("fx_convert") as stage:
+        report_cube = slice_time_span(ledger.converted_cube(fx_rates, reporting_currency, fx_modified), start_date, end_date) # converted once per ledger version and currency, a new time span only slices it
+        stage.observe(report_cube)
+    currency_label = " " + reporting_currency
+    missing_currencies = unconverted_currencies(filtered_cube, report_cube) # currencies of the time span that are not in the rate file
+    if missing_currencies:
+        st.warning(f":grey_exclamation: No exchange rates for {', '.join(missing_currencies)}, these entries are left out of the metrics and charts.")
+        report_cube = drop_unconverted(filtered_cube, report_cube)
 
 # Display total income and expense metrics
 col1, col2 = st.columns(2) # Create two side-by-side columns
 with col1:
-    total_income = filtered_data.loc[filtered_data["Type"] == "Income", "Amount"].sum() # Calculate the total income amount
-    st.metric(":chart_with_upwards_trend: Total Income", f"{total_income:.2f}") # Display total income as a metric
+    with profiler.stage("metrics") as stage:
+        total_income, total_expense = cube_totals(report_cube) # Calculate the total income and expense amounts from the daily sums
+        stage.observe(report_cube)
+    st.metric(":chart_with_upwards_trend: Total Income", f"{total_income:.2f}{currency_label}") # Display total income as a metric
 with col2:
-    total_expense = filtered_data.loc[filtered_data["Type"] == "Expense", "Amount"].sum() # Calculate the total expense amount
-    st.metric(":chart_with_downwards_trend: Total Expense", f"{total_expense:.2f}") # Display total expense as a metric
+    st.metric(":chart_with_downwards_trend: Total Expense", f"{total_expense:.2f}{currency_label}") # Display total expense as a metric
 
 # Create a section/expander to add a new entry
 with st.expander(":pencil2: Add New Entry", expanded=False): # Create an expandable section
@@ -179,7 +363,6 @@ with st.expander(":pencil2: Add New Entry", expanded=False): # Create an expanda
         if submitted:
             amount_val = -abs(amount_entry) if type_entry == "Expense" else abs(amount_entry) # Make amount negative for expenses, positive for income
             new_entry = { # Create a dictionary for the new entry with all fields
-                "Select": False,
                 "Date": pd.to_datetime(date_entry),
                 "Name": name_entry,
                 "Description": description_entry,
@@ -190,24 +373,35 @@ with st.expander(":pencil2: Add New Entry", expanded=False): # Create an expanda
                 "Payment Method": payment_method_entry,
                 "Project": project_entry
             }
-            st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_entry])], ignore_index=True) # Add the new entry to the session data
+            with profiler.stage("add_entry"):
+                new_rows = to_compact(pd.DataFrame([new_entry])) # cents and categories
+                ledger.append(store, new_rows) # Add the new entry to the database and to the loaded data at the right place
+            mark_ledger_changed()
             st.success(":white_check_mark: New entry was added successfully!") # Show a success message
             st.rerun() # Rerun the app to refresh everything
 
 # Display and edit entries
 st.write(":information_source: *The following table shows you all the entries you tracked during the selected time span. Select a row to edit your entries.*") # Add an information message
+if st.session_state.editor_conflict: # table edits were refused because the ledger was changed in another session
+    st.warning(":grey_exclamation: The data was changed in another session, your last changes in the table were not saved. The table now shows the current data, please make them again.")
+    st.session_state.editor_conflict = False
 if filtered_data.empty:
     st.info(":grey_exclamation: There is currently no data available for the selected time span.") # Show an info box if there are no entries
 else:
-    display_data = filtered_data[COLS_ORDER] # Reorder columns for displaying
-    edited_df = st.data_editor(display_data, key="data_editor", num_rows="dynamic", use_container_width=True) # Display an interactive editable table
-    for idx in edited_df.index:
-        st.session_state.data.loc[idx] = edited_df.loc[idx] # Update the session data with changes made in the editor
+    with profiler.stage("table_prepare") as stage:
+        display_data = to_display(filtered_data, ledger.selected_ids) # Bring the visible rows into the layout of the table (amounts, text, "Select")
+        stage.observe(display_data)
+    editor_key = f"data_editor_{st.session_state.editor_version}_{start_date:%Y%m%d}_{end_date:%Y%m%d}" # a new time span or saved changes give a fresh table
+    with profiler.stage("table_render"):
+        edited_df = st.data_editor( # Display an interactive editable table, changes are saved by on_editor_change
+            display_data, key=editor_key, num_rows="dynamic", use_container_width=True,
+            column_config={"Select": st.column_config.CheckboxColumn(default=False), "Date": st.column_config.DatetimeColumn(required=True)}, # new rows need a date
+            on_change=on_editor_change, args=(editor_key, display_data))
     selected_indices = edited_df.index[edited_df["Select"] == True].tolist() # Get a list of selected row indices based on the "Select" checkbox
     if len(selected_indices) == 1: # If exactly one row is selected, show an edit form for that entry
         idx = selected_indices[0] # Get the index of the single selected row
         st.write(":information_source: *You can now change the details of the selected entry.*") # Add an information message
-        entry = st.session_state.data.loc[idx].copy() # Copy the selected entry's data
+        entry = display_data.loc[idx].copy() # Copy the selected entry's data
         with st.form("edit_form"): # Create a form for editing the entry
             col1, col2, col3 = st.columns(3) # Create layout for the form
             with col1:
@@ -227,23 +421,28 @@ else:
             save_btn = st.form_submit_button(":floppy_disk: Save changes") # Button to save changes
             delete_btn = st.form_submit_button(":wastebasket: Delete entry") # Button to delete the entry
             if save_btn:
-                st.session_state.data.at[idx, "Date"] = pd.to_datetime(edited_date) # Save edited date
-                st.session_state.data.at[idx, "Name"] = edited_name # Save edited name
-                st.session_state.data.at[idx, "Description"] = edited_description # Save edited description
-                if edited_type == "Expense":
-                    st.session_state.data.at[idx, "Amount"] = -abs(edited_amount) # Save amount as negative for expenses
-                else:
-                    st.session_state.data.at[idx, "Amount"] = abs(edited_amount) # Save amount as positive for income
-                st.session_state.data.at[idx, "Category"] = edited_category # Save edited category
-                st.session_state.data.at[idx, "Type"] = edited_type # Save edited type
-                st.session_state.data.at[idx, "Currency"] = edited_currency # Save edited currency
-                st.session_state.data.at[idx, "Payment Method"] = edited_payment_method # Save edited payment method
-                st.session_state.data.at[idx, "Project"] = edited_project # Save edited project name
-                st.session_state.data.at[idx, "Select"] = False # Unselect the row after editing
+                edited_entry = { # Create a dictionary with the edited values of all fields
+                    "Date": pd.to_datetime(edited_date),
+                    "Name": edited_name,
+                    "Description": edited_description,
+                    "Amount": -abs(edited_amount) if edited_type == "Expense" else abs(edited_amount), # Save amount as negative for expenses and positive for income
+                    "Category": edited_category,
+                    "Type": edited_type,
+                    "Currency": edited_currency,
+                    "Payment Method": edited_payment_method,
+                    "Project": edited_project
+                }
+                with profiler.stage("save_entry"): # st.rerun() stops this rerun, the stage is counted to the next one
+                    edited_rows = to_compact(pd.DataFrame([edited_entry], index=[idx])) # cents and categories
+                    ledger.update(store, edited_rows) # Save the edited entry in the database, update the cube and keep the data sorted by date
+                ledger.selected_ids.discard(idx) # Unselect the row after editing
+                mark_ledger_changed()
                 st.success("Entry updated successfully!") # Show a success message
                 st.rerun() # Rerun the app to refresh everything
             elif delete_btn:
-                st.session_state.data = st.session_state.data.drop(idx).reset_index(drop=True) # Delete the selected row and reset the index
+                with profiler.stage("delete_entry"):
+                    ledger.delete(store, [idx]) # Delete the selected entry from the database and the selected row and take it out of the cube and the selection, the data stays sorted and the index keeps the database ids
+                mark_ledger_changed()
                 st.success("Entry deleted successfully!") # Show a success message after deletion
                 st.rerun() # Rerun the app to refresh everything
     elif len(selected_indices) > 1:
@@ -258,23 +457,25 @@ if filtered_data.empty:
     st.info(":grey_exclamation: No data available for analysis in the selected time span.") # Show info if there's no data to analyse
 else:
     group_by_option_bar_chart = st.selectbox("Group analysis by", options=["Project", "Payment Method", "Category", "Type", "Currency"], index=0) # Dropdown to choose how to group the bar charts
-    for grp in filtered_data[group_by_option_bar_chart].unique(): # Loop through each group in the selected category
-        grp_data = filtered_data[filtered_data[group_by_option_bar_chart] == grp].copy()  # Filter data for the current group
-        grp_data.sort_values("Date", inplace=True) # Sort group data by date
-        grouped = grp_data.groupby("Date", as_index=False)["Amount"].sum() # Group by date and sum the amounts
-        total_value = grp_data["Amount"].sum() # Calculate total value for the group
-        chart = alt.Chart(grouped).mark_bar().encode( # Create a bar chart using Altair
-            x=alt.X("Date:T", title="Date", axis=alt.Axis(format="%d. %m. %Y")), # Set x-axis as Date and force altair to use a specific date-format
-            y=alt.Y("Amount:Q", title="Amount"), # Set y-axis as Amount
-            color=alt.condition(alt.datum.Amount >= 0, alt.value("green"), alt.value("red")) # Color bars green for positive and red for negative amounts
-        ).properties(width=200, height=200) # Set the size of the chart
-        col1, col2, col3 = st.columns([1, 2, 1]) # Create layout with three columns (narrow-wide-narrow)
-        with col1:
-            st.write(f"**{grp}**") # Show the group name
-        with col2:
-            st.altair_chart(chart, use_container_width=True) # Display the chart in the middle column
-        with col3:
-            st.write(f"**Total: {total_value:.2f}**") # Show total amount for the group
+    with profiler.stage("bar_aggregate") as stage:
+        bar_data = bar_chart_data(report_cube, group_by_option_bar_chart) # Sum the daily amounts per group
+        stage.observe(bar_data)
+    with profiler.stage("bar_charts"): # Altair specs and rendering of all groups
+        for grp, grouped in bar_data.groupby(group_by_option_bar_chart, dropna=False, sort=False, observed=True): # Loop through each group in the selected category (one pass over the daily sums)
+            grouped = grouped[["Date", "Amount"]] # daily sums of the current group
+            total_value = grouped["Amount"].sum() # Calculate total value for the group
+            chart = alt.Chart(grouped).mark_bar().encode( # Create a bar chart using Altair
+                x=alt.X("Date:T", title="Date", axis=alt.Axis(format="%d. %m. %Y")), # Set x-axis as Date and force altair to use a specific date-format
+                y=alt.Y("Amount:Q", title="Amount"), # Set y-axis as Amount
+                color=alt.condition(alt.datum.Amount >= 0, alt.value("green"), alt.value("red")) # Color bars green for positive and red for negative amounts
+            ).properties(width=200, height=200) # Set the size of the chart
+            col1, col2, col3 = st.columns([1, 2, 1]) # Create layout with three columns (narrow-wide-narrow)
+            with col1:
+                st.write(f"**{grp}**") # Show the group name
+            with col2:
+                st.altair_chart(chart, use_container_width=True) # Display the chart in the middle column
+            with col3:
+                st.write(f"**Total: {total_value:.2f}{currency_label}**") # Show total amount for the group
 
 # Pie chart
 st.write(":information_source: *The following pie-chart shows you all the entries you tracked during the selected time span. They are grouped by the selected option.*") # Info text explaining the pie chart
@@ -282,10 +483,20 @@ if filtered_data.empty:
     st.info(":grey_exclamation: No data available for the pie chart in the selected time span.") # Show info if no data for pie chart
 else:
     group_by_option_pie_chart = st.selectbox("Group analysis by", options=["Project", "Payment Method", "Category", "Type", "Currency"], index=2) # Dropdown to select pie chart grouping
-    pie_data = filtered_data.groupby(group_by_option_pie_chart, as_index=False)["Amount"].sum() # Group data by selected option and sum amounts
-    pie_chart = alt.Chart(pie_data).mark_arc(innerRadius=50).encode( # Create a donut pie chart with an inner radius
-        theta=alt.Theta(field="Amount", type="quantitative", aggregate="sum"), # Set slice size based on Amount
-        color=alt.Color(field=group_by_option_pie_chart, type="nominal"), # Color slices based on grouping
-        tooltip=[group_by_option_pie_chart, alt.Tooltip("Amount", format=".2f")]  # Add tooltips showing group name and amount
-    ).properties(width=400, height=400) # Set the size of the pie chart
-    st.altair_chart(pie_chart, use_container_width=True) # Display the pie chart
+    with profiler.stage("pie_aggregate") as stage:
+        pie_data = pie_chart_data(report_cube, group_by_option_pie_chart) # Group data by selected option and sum amounts
+        stage.observe(pie_data)
+    with profiler.stage("pie_chart"):
+        pie_chart = alt.Chart(pie_data).mark_arc(innerRadius=50).encode( # Create a donut pie chart with an inner radius
+            theta=alt.Theta(field="Amount", type="quantitative", aggregate="sum"), # Set slice size based on Amount
+            color=alt.Color(field=group_by_option_pie_chart, type="nominal"), # Color slices based on grouping
+            tooltip=[group_by_option_pie_chart, alt.Tooltip("Amount", format=".2f")]  # Add tooltips showing group name and amount
+        ).properties(width=400, height=400) # Set the size of the pie chart
+        st.altair_chart(pie_chart, use_container_width=True) # Display the pie chart
+
+# Show the measurements of this rerun in the "Performance" expander (and write them to the log file)
+record = profiler.finish()
+if record is not None:
+    with rerun_panel:
+        st.write(f"Rerun {record['rerun']}: **{record['seconds'] * 1000:.1f} ms**") # time of the whole script
+        st.dataframe(rerun_table(record), hide_index=True, width="stretch") # time, rows and memory (MB) of every stage
@@ -0,0 +1,201 @@
+# -----------------------------------------------------------------------------
+# Checks of the BudgetBuddy data pipeline (budget_core + ledger_store), without Streamlit.
+# Every check runs on a small synthetic ledger in a temporary database and stops with an AssertionError if the result is wrong.
+# Run: python benchmarks/check_pipeline.py
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # make the app modules importable when the script is run directly
+from budget_core import CUBE_DIMS, ExportCache, LoadedLedger, iter_row_chunks, to_compact, to_display, build_cube, cube_totals, month_span, week_span, custom_span
+from ledger_store import LedgerStore
+from fx_rates import load_fx_rates, convert_cube, drop_unconverted, unconverted_currencies
+from statement_import import new_transactions
+from generate_ledger import generate_ledger
+
+CHECK_YEAR = 2025
+
+
+# Create a function to fill a fresh database in workdir with a generated ledger of one year and load that year
+def make_loaded_ledger(workdir, rows=20_000, name="check.db"):
+    store = LedgerStore(str(Path(workdir) / name))
+    store.replace_all(to_compact(generate_ledger(rows, start=f"{CHECK_YEAR}-01-01", end=f"{CHECK_YEAR}-12-31 23:59")))
+    ledger = LoadedLedger()
+    ledger.load(store, (CHECK_YEAR, CHECK_YEAR))
+    return store, ledger
+
+
+# Create a function to sum up the income and the expenses of the rows themselves (like the table shows them)
+def row_totals(rows):
+    return rows.loc[rows["Type"] == "Income", "Cents"].sum() / 100, rows.loc[rows["Type"] == "Expense", "Cents"].sum() / 100
+
+
+# The metrics and charts (cube) must count exactly the rows the table shows, for every kind of time span
+def check_visible_totals(ledger):
+    spans = [month_span(CHECK_YEAR, month) for month in range(1, 13)]
+    spans += [week_span(CHECK_YEAR, 23), custom_span(f"{CHECK_YEAR}-03-10", f"{CHECK_YEAR}-03-10"), custom_span(f"{CHECK_YEAR}-02-27", f"{CHECK_YEAR}-04-02")]
+    for start, end in spans:
+        rows, cube = ledger.visible(start, end)
+        assert len(rows) == cube["Count"].sum(), (start, end, len(rows), cube["Count"].sum())
+        assert cube_totals(cube) == row_totals(rows), (start, end, cube_totals(cube), row_totals(rows))
+        assert rows["Date"].max() < end + pd.Timedelta(days=1) and rows["Date"].min() >= start
+
+
+# After rows are added, edited and deleted, the cube must still have categorical dimensions and the same cells as a cube built from scratch
+def check_cube_updates(ledger):
+    new_rows = to_compact(to_display(ledger.data.iloc[:5]).assign(Category="Check Category")) # a category the cube does not know yet
+    new_rows.index = ledger.data.index.max() + 1 + pd.RangeIndex(5)
+    ledger.add_rows(new_rows)
+    edited = to_compact(to_display(ledger.data.iloc[10:15]).assign(Currency="Check Currency"))
+    ledger.replace_rows(edited)
+    ledger.remove_rows(ledger.data.index[20:25])
+    for dim in CUBE_DIMS:
+        assert isinstance(ledger.cube[dim].dtype, pd.CategoricalDtype), (dim, ledger.cube[dim].dtype)
+    rebuilt = build_cube(ledger.data)
+    columns = ["Date"] + CUBE_DIMS + ["Cents", "Count"]
+    pd.testing.assert_frame_equal(ledger.cube[columns].astype(str).reset_index(drop=True), rebuilt[columns].astype(str).reset_index(drop=True))
+
+
+
+# The change set of the table (positions in the shown rows) is saved to the right rows of the store: a change of the selection only is not saved,
+# a new Type flips the sign of the amount, added rows are stored and the cube stays the same as a cube built from the rows
+def check_editor_changes(workdir):
+    store, ledger = make_loaded_ledger(workdir, rows=2_000, name="editor.db")
+    display_data = to_display(ledger.visible(*month_span(CHECK_YEAR, 6))[0])
+    version = store.version
+    assert not ledger.apply_editor_changes({"edited_rows": {0: {"Select": True}}}, display_data, store)
+    assert store.version == version and ledger.selected_ids == {display_data.index[0]}
+    flipped = {"Income": "Expense", "Expense": "Income"}[display_data["Type"].iloc[1]]
+    changes = {
+        "edited_rows": {1: {"Type": flipped}, "2": {"Amount": 12.34, "Category": "Check Category"}}, # positions, the table may report them as text
+        "added_rows": [{"Date": f"{CHECK_YEAR}-06-15T12:00:00", "Name": "Check Added", "Amount": 5.0, "Type": "Expense"}],
+        "deleted_rows": [3, 4],
+    }
+    assert ledger.apply_editor_changes(changes, display_data, store)
+    stored = store.load_span(pd.Timestamp(f"{CHECK_YEAR}-01-01"), pd.Timestamp(f"{CHECK_YEAR + 1}-01-01"))
+    original = to_compact(display_data.iloc[:3])
+    assert stored.loc[display_data.index[1], "Cents"] == -original["Cents"].iloc[1]
+    assert stored.loc[display_data.index[1], "Type"] == flipped
+    assert stored.loc[display_data.index[2], "Cents"] == (1234 if display_data["Type"].iloc[2] == "Income" else -1234)
+    assert stored.loc[display_data.index[2], "Category"] == "Check Category"
+    assert not stored.index.isin(display_data.index[3:5]).any() and not ledger.data.index.isin(display_data.index[3:5]).any()
+    added = stored[stored["Name"] == "Check Added"]
+    assert len(added) == 1 and added["Cents"].iloc[0] == -500 and added.index[0] in ledger.data.index
+    assert store.version == version + 3 and not ledger.is_stale(store) # one write per kind of change
+    pd.testing.assert_frame_equal(stored[ledger.data.columns], ledger.data, check_dtype=False, check_categorical=False)
+    columns = ["Date"] + CUBE_DIMS + ["Cents", "Count"]
+    pd.testing.assert_frame_equal(ledger.cube[columns].astype(str).reset_index(drop=True), build_cube(ledger.data)[columns].astype(str).reset_index(drop=True))
+
+
+# Two sessions share one store: a write of one session makes the ledger of the other stale, while its own writes keep it up to date
+def check_shared_store(ledger, store):
+    other = LoadedLedger()
+    other.load(store, (CHECK_YEAR, CHECK_YEAR))
+    assert not ledger.is_stale(store) and not other.is_stale(store)
+    ids = other.append(store, to_compact(to_display(other.data.iloc[:3])))
+    assert ledger.is_stale(store) and not other.is_stale(store)
+    ledger.load(store, (CHECK_YEAR, CHECK_YEAR))
+    assert len(ledger.data) == len(other.data) and ledger.data.index.isin(ids).sum() == 3
+    other.delete(store, ids)
+    assert ledger.is_stale(store) and not other.is_stale(store)
+
+
+
+# A deleted export file is written again, and an export of an older ledger version does not push out the files of a newer one
+def check_export_cache(ledger, workdir):
+    cache = ExportCache(workdir)
+    key = (2, "CSV", ("span",))
+    path = cache.write(key, lambda: iter_row_chunks(ledger.data))
+    assert cache.get(key) == path and path.exists()
+    path.unlink()
+    assert cache.get(key) is None
+    path = cache.write(key, lambda: iter_row_chunks(ledger.data))
+    cache.write((1, "CSV", ("span",)), lambda: iter_row_chunks(ledger.data.iloc[:10])) # a session that loaded its rows before the last change
+    assert cache.get(key) == path and path.exists()
+    cache.write((3, "CSV", ("span",)), lambda: iter_row_chunks(ledger.data))
+    assert cache.get(key) is None and path.exists() # no longer reused, but kept for a download button that still points to it
+    # Two sessions ask for the same export at once: it is written once, and the other exports can be looked up while it is written
+    started, release, calls = threading.Event(), threading.Event(), []
+    def slow_chunks():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return iter_row_chunks(ledger.data)
+    key = (4, "Parquet", ("all",))
+    with ThreadPoolExecutor(2) as threads:
+        first = threads.submit(cache.write, key, slow_chunks)
+        started.wait()
+        second = threads.submit(cache.write, key, slow_chunks)
+        assert cache.get((3, "CSV", ("span",))) is not None
+        release.set()
+        assert first.result() == second.result() == cache.get(key) and len(calls) == 1
+
+
+# Overlapping statements add a transaction once, a statement uploaded again adds nothing, equal transactions within one statement and
+# rows without a date are kept
+def check_deduplicate(workdir):
+    store = LedgerStore(str(Path(workdir) / "dedup.db"))
+    rows = to_compact(generate_ledger(40, start=f"{CHECK_YEAR}-01-01", end=f"{CHECK_YEAR}-12-31 23:59")).sort_values("Date", kind="stable").reset_index(drop=True)
+    first_half, second_half = rows.iloc[:20], rows.iloc[10:30] # 10 rows are in both statements
+    new_rows, skipped = new_transactions([first_half, second_half], store)
+    assert (len(new_rows), skipped) == (30, 10), (len(new_rows), skipped)
+    store.append(new_rows)
+    new_rows, skipped = new_transactions([first_half, second_half], store) # the same statements uploaded again
+    assert (len(new_rows), skipped) == (0, 40), (len(new_rows), skipped)
+    twice = rows.iloc[[30, 30, 31]] # two coffees on the same day
+    new_rows, skipped = new_transactions([twice], store)
+    assert (len(new_rows), skipped) == (3, 0), (len(new_rows), skipped)
+    store.append(new_rows)
+    assert new_transactions([twice], store)[0].empty
+    undated = rows.iloc[32:36].assign(Date=pd.NaT)
+    new_rows, skipped = new_transactions([undated], store)
+    assert (len(new_rows), skipped) == (4, 0), (len(new_rows), skipped)
+    store.append(new_rows)
+    new_rows, skipped = new_transactions([undated, rows.iloc[36:40]], store) # undated rows are found again next to dated ones
+    assert (len(new_rows), skipped) == (4, 4), (len(new_rows), skipped)
+
+
+
+# The conversion into a reporting currency uses the last rate on or before a day (the first rate for days before it), the base currency has the rate 1,
+# cells without a currency keep their amount and cells in a currency without rates are left out
+def check_fx_conversion(workdir):
+    rate_file = Path(workdir) / "fx_rates.csv"
+    rate_file.write_text(f"Date,Currency,Rate\n{CHECK_YEAR}-01-20,EUR,1.2\n{CHECK_YEAR}-01-10,eur,1.0\n")
+    rates = load_fx_rates(rate_file)
+    cube = pd.DataFrame({
+        "Date": pd.to_datetime([f"{CHECK_YEAR}-01-05", f"{CHECK_YEAR}-01-15"] + [f"{CHECK_YEAR}-01-25"] * 4),
+        "Currency": pd.Categorical(["EUR", "EUR", "EUR", "CHF", None, "USD"]),
+        "Cents": [1000, 1000, 1000, 200, 200, 500], # 10.00 EUR at 1.0 (before the first rate), 10.00 EUR at 1.0, 10.00 EUR at 1.2, 2.00 CHF, 2.00 without currency, 5.00 USD
+    })
+    converted = convert_cube(cube, rates, "CHF")
+    assert converted["Cents"].tolist()[:5] == [1000, 1000, 1200, 200, 200] and pd.isna(converted["Cents"].iloc[5]), converted["Cents"].tolist()
+    assert unconverted_currencies(cube, converted) == ["USD"]
+    reported = drop_unconverted(cube, converted)
+    assert len(reported) == 5 and round(reported["Cents"].sum() / 100, 2) == 36.00, reported
+    in_eur = convert_cube(cube, rates, "EUR") # the other way round: EUR stays, 2.00 CHF on a day with the rate 1.2 are 1.67 EUR
+    assert in_eur["Cents"].round(2).tolist()[:4] == [1000, 1000, 1000, 166.67], in_eur["Cents"].tolist()
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as workdir:
+        store, ledger = make_loaded_ledger(workdir)
+        for check in [check_visible_totals, check_cube_updates]:
+            check(ledger)
+            print(f"{check.__name__}: ok")
+        check_editor_changes(workdir)
+        print("check_editor_changes: ok")
+        check_shared_store(ledger, store)
+        print("check_shared_store: ok")
+        check_export_cache(ledger, workdir)
+        print("check_export_cache: ok")
+        check_deduplicate(workdir)
+        print("check_deduplicate: ok")
+        check_fx_conversion(workdir)
+        print("check_fx_conversion: ok")
@@ -0,0 +1,49 @@
+# -----------------------------------------------------------------------------
+# Compare the memory use and groupby speed of the old ledger layout (text columns, float amounts, "Select" column)
+# with the compact layout (categorical columns, whole cents) on a synthetic ledger.
+# Run: python benchmarks/compact_ledger.py [rows]
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # make the app modules importable when the script is run directly
+from budget_core import DIMENSION_COLS, to_compact
+from generate_ledger import generate_ledger
+
+
+# Create a function to time a function (best of some runs)
+def best_time(func, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    old = generate_ledger(rows).astype({col: object for col in DIMENSION_COLS + ["Description"]}) # plain Python strings, like the app used to keep them
+    compact = to_compact(old)
+
+    old_mb = old.memory_usage(deep=True).sum() / 1e6
+    compact_mb = compact.memory_usage(deep=True).sum() / 1e6
+    print(f"rows: {rows:,}")
+    print(f"memory            old: {old_mb:8.1f} MB   compact: {compact_mb:8.1f} MB   ({old_mb / compact_mb:.1f}x)")
+
+    for col in ["Category", "Project", "Payment Method"]:
+        old_time = best_time(lambda: old.groupby(col)["Amount"].sum())
+        compact_time = best_time(lambda: compact.groupby(col, observed=True)["Cents"].sum())
+        print(f"groupby {col:<14} old: {old_time * 1000:8.1f} ms   compact: {compact_time * 1000:8.1f} ms   ({old_time / compact_time:.1f}x)")
+
+    keys = ["Type", "Category", "Project", "Payment Method", "Currency"]
+    old_time = best_time(lambda: old.groupby([old["Date"].dt.normalize()] + keys)["Amount"].sum(), repeat=3)
+    compact_time = best_time(lambda: compact.groupby([compact["Date"].dt.normalize()] + keys, observed=True)["Cents"].sum(), repeat=3)
+    print(f"daily cube          old: {old_time * 1000:8.1f} ms   compact: {compact_time * 1000:8.1f} ms   ({old_time / compact_time:.1f}x)")
+
+    old_total = float(old["Amount"].sum())
+    compact_total = compact["Cents"].sum()
+    print(f"total             old: {old_total!r}   compact: {compact_total / 100:.2f} (exact cents: {compact_total})")
@@ -0,0 +1,117 @@
+# -----------------------------------------------------------------------------
+# Generator for synthetic ledgers in the layout of demo_finances.csv.
+# The ledgers look like real bank exports: mostly expenses at a fixed set of merchants, a monthly salary,
+# a few currencies and payment methods, sorted by date. Large ledgers are written to CSV chunk by chunk.
+# Run: python benchmarks/generate_ledger.py <rows> <output.csv> [--seed N]
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import argparse
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # make budget_core importable when the script is run directly
+from budget_core import COLS_ORDER, CSV_DATE_FORMAT
+
+# Define the merchants of the expenses: (name, category, description, typical amount)
+MERCHANTS = [
+    ("Groceries", "Groceries", "Weekly food shopping", 85),
+    ("Supermarket", "Groceries", "Food and household items", 40),
+    ("Rent", "Housing", "Monthly rent", 1800),
+    ("Electricity Bill", "Utilities", "Monthly usage", 80),
+    ("Internet Bill", "Utilities", "Fiber subscription", 60),
+    ("Mobile Phone", "Utilities", "Phone plan", 45),
+    ("Public Transport", "Transport", "Monthly pass", 75),
+    ("Petrol", "Transport", "Fuel", 70),
+    ("Taxi", "Transport", "Ride home", 30),
+    ("Restaurant Dinner", "Restaurants", "Dinner with friends", 90),
+    ("Coffee", "Restaurants", "Coffee to go", 6),
+    ("Health Insurance", "Insurance", "Monthly premium", 350),
+    ("Pharmacy", "Healthcare", "Medicine", 25),
+    ("Gym Membership", "Health & Fitness", "Monthly fee", 70),
+    ("Netflix", "Subscriptions", "Streaming", 18),
+    ("Spotify", "Subscriptions", "Music", 13),
+    ("Cinema", "Entertainment", "Movie ticket", 20),
+    ("Clothing", "Clothing", "New clothes", 120),
+    ("Bookstore", "Education", "Books", 35),
+    ("Haircut", "Personal Care", "Hairdresser", 45),
+]
+
+# Define the income sources: (name, category, description, typical amount)
+INCOMES = [
+    ("Monthly Salary", "Income", "Net salary", 6000),
+    ("Freelance Project", "Income", "Invoice paid", 1200),
+]
+
+INCOME_SHARE = 0.05 # share of the rows that are income
+CURRENCIES = (["CHF", "EUR", "USD"], [0.8, 0.15, 0.05])
+PAYMENT_METHODS = (["Debit Card", "Credit Card", "Cash", "Bank Transfer", "Paypal"], [0.4, 0.3, 0.1, 0.15, 0.05])
+PROJECTS = (["Personal", "Household", "Freelance"], [0.6, 0.3, 0.1])
+TYPICAL_RATES = {"EUR": 0.95, "USD": 0.88} # value of one unit in CHF, the base currency of fx_rates.csv
+
+
+# Create a function to generate a ledger with the given number of rows between start and end, sorted by date.
+def generate_ledger(rows, seed=0, start="2015-01-01", end="2025-12-31"):
+    rng = np.random.default_rng(seed)
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    minutes = np.sort(rng.integers(0, int((end - start) / pd.Timedelta(minutes=1)), rows)) # minute of the transaction within the span
+    dates = start + pd.to_timedelta(minutes, unit="min")
+
+    is_income = rng.random(rows) < INCOME_SHARE
+    sources = np.where(is_income, rng.integers(0, len(INCOMES), rows), rng.integers(0, len(MERCHANTS), rows))
+    lookup = lambda items, field: np.array([item[field] for item in items], dtype=object)
+    pick = lambda field: np.where(is_income, lookup(INCOMES, field)[sources % len(INCOMES)], lookup(MERCHANTS, field)[sources % len(MERCHANTS)])
+
+    typical = pick(3).astype(float)
+    amounts = np.round(typical * rng.lognormal(0, 0.35, rows), 2) # amounts vary around the typical amount
+    choose = lambda options: rng.choice(options[0], size=rows, p=options[1])
+
+    return pd.DataFrame({
+        "Select": False,
+        "Date": dates,
+        "Name": pick(0),
+        "Description": pick(2),
+        "Amount": np.where(is_income, amounts, -amounts), # expenses are negative
+        "Category": pick(1),
+        "Type": np.where(is_income, "Income", "Expense"),
+        "Currency": choose(CURRENCIES),
+        "Payment Method": choose(PAYMENT_METHODS),
+        "Project": choose(PROJECTS),
+    }, columns=COLS_ORDER)
+
+
+# Create a function to generate daily exchange rates (in the layout of fx_rates.csv) for the currencies of the ledger except the base currency.
+# The rates are a random walk around a typical value, on working days only, like published rates.
+def generate_fx_rates(seed=0, start="2015-01-01", end="2025-12-31", typical=TYPICAL_RATES):
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(start, end)
+    return pd.concat([
+        pd.DataFrame({"Date": days, "Currency": currency, "Rate": np.round(rate * np.exp(np.cumsum(rng.normal(0, 0.003, len(days)))), 4)})
+        for currency, rate in typical.items()
+    ], ignore_index=True)
+
+
+# Create a function to write a generated ledger to a CSV file, chunk by chunk, so even 10M rows never have to be in memory at once.
+# Every chunk covers its own part of the time span, so the whole file stays sorted by date.
+def write_ledger_csv(path, rows, seed=0, start="2015-01-01", end="2025-12-31", chunk_rows=1_000_000):
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    chunks = max(1, -(-rows // chunk_rows)) # round up
+    bounds = pd.date_range(start, end, periods=chunks + 1)
+    for i in range(chunks):
+        chunk_size = min(chunk_rows, rows - i * chunk_rows)
+        chunk = generate_ledger(chunk_size, seed=seed + i, start=bounds[i], end=bounds[i + 1])
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=(i == 0), index=False, date_format=CSV_DATE_FORMAT)
+    return Path(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic BudgetBuddy ledger to a CSV file.")
+    parser.add_argument("rows", type=int, help="number of transactions, e.g. 10000 or 10000000")
+    parser.add_argument("output", help="path of the CSV file")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_ledger_csv(args.output, args.rows, seed=args.seed)
+    print(f"wrote {args.rows:,} rows to {args.output}")
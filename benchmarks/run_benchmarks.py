@@ -0,0 +1,134 @@
+# -----------------------------------------------------------------------------
+# Benchmark suite of the BudgetBuddy data pipeline (budget_core + ledger_store), without Streamlit.
+# For every ledger size a synthetic CSV is generated and each step the app runs is timed:
+# import, saving to the database, deduplicating a re-import, loading a year, filtering, the table write-back, every chart aggregation, the currency conversion and the export in every format.
+# The suite runs twice: once to measure the time, once with tracemalloc to measure the peak memory (Python and NumPy allocations).
+# Run: python benchmarks/run_benchmarks.py --rows 10000 100000 1000000 [--save results.json] [--compare baseline.json]
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent)) # make the app modules importable when the script is run directly
+from budget_core import (CUBE_DIMS, LoadedLedger, load_csv_in_chunks, month_span, to_display, cube_totals,
+                         bar_chart_data, pie_chart_data, EXPORT_FORMATS, write_export)
+from ledger_store import LedgerStore
+from statement_import import new_transactions
+from fx_rates import load_fx_rates
+from generate_ledger import write_ledger_csv, generate_fx_rates
+
+LAST_YEAR = 2025 # the generated ledgers end in this year, it is the year that gets loaded
+FILTER_REPEATS = 100 # the filter is fast, so it is repeated and the average is reported
+
+
+# Create a function to run all steps of the pipeline once. measure(name, func) runs a step and records its result.
+def run_suite(csv_path, workdir, measure):
+    with open(csv_path, "rb") as file:
+        df = measure("import_csv", lambda: load_csv_in_chunks(file))
+
+    db_path = Path(workdir) / f"bench_{time.time_ns()}.db" # a fresh database for every pass
+    store = LedgerStore(str(db_path))
+    measure("store_replace", lambda: store.replace_all(df))
+    measure("import_deduplicate", lambda: new_transactions([df], store)) # importing the same file again, every row is a duplicate
+
+    ledger = LoadedLedger()
+    measure("load_year", lambda: ledger.load(store, (LAST_YEAR, LAST_YEAR)))
+
+    start, end = month_span(LAST_YEAR, 6)
+    def filter_month():
+        for _ in range(FILTER_REPEATS):
+            visible = ledger.visible(start, end)
+        return visible
+    filtered_data, _ = measure("filter_month", filter_month, repeats=FILTER_REPEATS)
+
+    # change set like the one st.data_editor reports: 20 edited, 10 added and 10 deleted rows
+    display_data = to_display(filtered_data)
+    changes = {
+        "edited_rows": {pos: {"Amount": 12.34, "Category": "Benchmark"} for pos in range(20)},
+        "added_rows": [{"Date": f"{LAST_YEAR}-06-15T12:00:00", "Name": "Benchmark", "Amount": 1.0, "Type": "Expense"} for _ in range(10)],
+        "deleted_rows": list(range(20, 30)),
+    }
+    measure("editor_write_back", lambda: ledger.apply_editor_changes(changes, display_data, store))
+
+    measure("chart_totals", lambda: cube_totals(ledger.cube))
+    fx_path = Path(workdir) / "fx_rates.csv"
+    generate_fx_rates().to_csv(fx_path, index=False)
+    measure("fx_convert", lambda: ledger.converted_cube(load_fx_rates(fx_path), "EUR")) # converts the cube of the loaded year once
+    for dim in CUBE_DIMS:
+        measure(f"chart_bar[{dim}]", lambda: bar_chart_data(ledger.cube, dim))
+        measure(f"chart_pie[{dim}]", lambda: pie_chart_data(ledger.cube, dim))
+
+    for fmt, (extension, _) in EXPORT_FORMATS.items():
+        export_path = Path(workdir) / f"export_{time.time_ns()}{extension}"
+        measure(f"export[{fmt}]", lambda: write_export(store.iter_chunks(), export_path, fmt))
+        export_path.unlink()
+    db_path.unlink()
+
+
+# Create a function to run the suite for one CSV file and return {step: {"seconds": ..., "peak_mb": ...}}
+def benchmark_file(csv_path, workdir):
+    results = {}
+
+    def measure_time(name, func, repeats=1):
+        start = time.perf_counter()
+        value = func()
+        results.setdefault(name, {})["seconds"] = (time.perf_counter() - start) / repeats
+        return value
+
+    def measure_memory(name, func, repeats=1):
+        tracemalloc.start()
+        value = func()
+        results[name]["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        return value
+
+    run_suite(csv_path, workdir, measure_time)
+    run_suite(csv_path, workdir, measure_memory)
+    return results
+
+
+# Create a function to compare results with a saved baseline. Steps that got slower than tolerance x baseline are returned,
+# differences below min_ms are ignored because steps that take a few milliseconds vary too much between runs.
+def find_regressions(results, baseline, tolerance, min_ms=5.0):
+    regressions = []
+    for rows, steps in results.items():
+        for step, values in steps.items():
+            before = baseline.get(rows, {}).get(step)
+            if before and values["seconds"] > before["seconds"] * tolerance and (values["seconds"] - before["seconds"]) * 1000 > min_ms:
+                regressions.append(f"{rows} rows, {step}: {before['seconds'] * 1000:.1f} ms -> {values['seconds'] * 1000:.1f} ms")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the BudgetBuddy data pipeline on synthetic ledgers.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="ledger sizes, e.g. 10000 1000000 10000000")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run, steps that are slower than --tolerance times that run are reported")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--min-ms", type=float, default=5.0, help="ignore differences smaller than this many milliseconds")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.rows:
+            csv_path = write_ledger_csv(Path(workdir) / f"ledger_{rows}.csv", rows)
+            print(f"\n{rows:,} rows ({csv_path.stat().st_size / 1e6:.1f} MB CSV)")
+            print(f"{'step':<28}{'time':>12}{'peak memory':>16}")
+            results[str(rows)] = benchmark_file(csv_path, workdir)
+            for step, values in results[str(rows)].items():
+                print(f"{step:<28}{values['seconds'] * 1000:>9.1f} ms{values['peak_mb']:>13.1f} MB")
+
+    if args.save:
+        Path(args.save).write_text(json.dumps(results, indent=2))
+    if args.compare:
+        regressions = find_regressions(results, json.loads(Path(args.compare).read_text()), args.tolerance, args.min_ms)
+        print("\nregressions:" if regressions else "\nno regressions")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1 if regressions else 0)
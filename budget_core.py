@@ -0,0 +1,427 @@
+# -----------------------------------------------------------------------------
+# Data pipeline of BudgetBuddy: CSV import, layout conversions, time spans, filtering, aggregation and export.
+# Nothing in here uses Streamlit, so every step can be imported, timed and tested without a browser (see benchmarks/).
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import gzip
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fx_rates import convert_cube
+
+
+# Define the column order for the finance tracker. "Select" is the first column to facilitate row selection.
+# This is the layout of the table, the CSV import and the CSV export.
+COLS_ORDER = ["Select", "Date", "Name", "Description", "Amount", "Category", "Type", "Currency", "Payment Method", "Project"]
+
+# Define the compact layout the ledger is kept in while the app runs: the amounts are whole cents (int64) in "Cents" and
+# the columns with few different values are categorical. The selection ("Select") is not part of the data, it is kept in LoadedLedger.selected_ids.
+DATA_COLS = ["Date", "Name", "Description", "Cents", "Category", "Type", "Currency", "Payment Method", "Project"]
+DIMENSION_COLS = ["Name", "Category", "Type", "Currency", "Payment Method", "Project"]
+
+# Define how uploaded CSV files are read. Files are read in chunks with explicit dtypes so large bank exports don't have to be held in memory as a whole.
+CSV_CHUNK_ROWS = 100_000 # number of rows parsed per chunk
+CSV_DATE_FORMAT = "%m/%d/%Y %H:%M" # date layout used in demo_finances.csv (e.g. 05/01/2025 00:00)
+CSV_DATE_PATTERN = r"^(\d{2})/(\d{2})/(\d{4}) (\d{2}:\d{2})$" # the same layout as a regular expression, used to reorder the dates before parsing
+CSV_DTYPES = {col: str for col in COLS_ORDER if col != "Select"} # read every column as text first, "Date" and "Amount" are converted per chunk
+
+# Define the file formats of the export: label -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+EXPORT_CHUNK_ROWS = 100_000 # number of rows converted and written per chunk
+EXPORT_CACHE_FILES = 8 # number of export files kept for reuse
+EXPORT_KEEP_SECONDS = 600 # a file that is no longer reused is deleted only after this time, so a download button that still points to it keeps working
+EXPORT_GZIP_LEVEL = 6 # compression level of "CSV (gzip)", level 9 is slower and the file only slightly smaller
+PARQUET_SCHEMA = pa.schema([(col, {"Select": pa.bool_(), "Date": pa.timestamp("ns"), "Amount": pa.float64()}.get(col, pa.string())) for col in COLS_ORDER]) # fixed, so every chunk has the same types
+
+# Create a function to sanitize the user input. This function removes commas from user-input strings to prevent issues with CSV formatting.
+def sanitize_input(s):
+    if s is None:
+        return s
+    return s.replace(",", "")
+
+# Create a function to force the sign of the amounts: expenses are always negative, income is always positive.
+def normalize_amount_signs(df):
+    type_lower = df["Type"].str.lower() # lower-case the "Type" column once and reuse it for both masks
+    mask_expense = type_lower.isin(["expense", "expenses"]) # Create a mask for rows where "Type" is "expense" or "expenses" (case-insensitive).
+    mask_income = ~mask_expense & (type_lower == "income") # Create a mask for rows where "Type" is "income" (case-insensitive).
+    df.loc[mask_expense, "Amount"] = -df.loc[mask_expense, "Amount"].abs() # Set all expense amounts to negative (force positive first, then negate)
+    df.loc[mask_income, "Amount"] = df.loc[mask_income, "Amount"].abs() # Set all income amounts to positive (force positive).
+    return df
+
+# Create a function to convert rows in the layout of COLS_ORDER (amounts, text) into the compact layout of DATA_COLS (cents, categories).
+# Rows read from the database already have "Cents", only their text columns are turned into categories.
+def to_compact(df):
+    compact = pd.DataFrame(index=df.index)
+    for col in DATA_COLS:
+        if col == "Cents" and "Cents" in df.columns:
+            compact[col] = df[col]
+        elif col == "Cents":
+            compact[col] = (pd.to_numeric(df["Amount"], errors="coerce") * 100).round().astype("Int64") # whole cents, missing amounts stay missing
+        elif col in DIMENSION_COLS:
+            compact[col] = df[col].astype("category")
+        else:
+            compact[col] = df[col]
+    return compact
+
+# Create a function to convert compact rows back into the layout of COLS_ORDER, e.g. for the table or the CSV export.
+def to_display(df, selected_ids=()):
+    display = pd.DataFrame(index=df.index)
+    for col in COLS_ORDER:
+        if col == "Select":
+            display[col] = df.index.isin(list(selected_ids)) # tick the rows the user selected
+        elif col == "Amount":
+            display[col] = df["Cents"].astype("float64") / 100 # back to amounts with two decimals
+        elif col in DIMENSION_COLS:
+            display[col] = df[col].astype(object) # plain text, so the table lets the user type any value
+        else:
+            display[col] = df[col]
+    return display
+
+# Create a function to concatenate compact DataFrames (rows or cubes). The categorical columns get the same categories first, otherwise pandas would turn them into text columns.
+def concat_compact(frames):
+    frames = [frame.copy(deep=False) for frame in frames if len(frame) > 0] or frames[:1] # empty frames carry no categories and no date type
+    for col in [col for col in DIMENSION_COLS if col in frames[0].columns]: # a cube has no "Name" column
+        columns = [frame[col].astype("category") for frame in frames]
+        categories = columns[0].cat.categories
+        for column in columns[1:]:
+            categories = categories.append(column.cat.categories.difference(categories)) # new categories are added at the end, the existing ones keep their codes
+        for frame, column in zip(frames, columns):
+            frame[col] = column.cat.set_categories(categories)
+    return pd.concat(frames)
+
+# Create a function to clean one chunk of an uploaded CSV file (dates, amounts and signs).
+def clean_csv_chunk(chunk):
+    raw_dates = chunk["Date"]
+    iso_dates = raw_dates.str.replace(CSV_DATE_PATTERN, r"\3-\1-\2 \4", regex=True) # reorder MM/DD/YYYY HH:MM into YYYY-MM-DD HH:MM, pandas parses that layout much faster
+    chunk["Date"] = pd.to_datetime(iso_dates, format="%Y-%m-%d %H:%M", errors="coerce") # parse the dates with the declared format, this is much faster than guessing it
+    unparsed = chunk["Date"].isna() & raw_dates.notna() # rows that are not in the declared format (e.g. files exported by BudgetBuddy itself)
+    if unparsed.any():
+        chunk.loc[unparsed, "Date"] = pd.to_datetime(raw_dates[unparsed], errors="coerce") # only let pandas guess the format for those rows
+    chunk["Amount"] = pd.to_numeric(chunk["Amount"].str.replace(r"[,']", "", regex=True), errors="coerce") # clean up the "Amount" column: remove commas/apostrophes, then convert into numeric
+    chunk = normalize_amount_signs(chunk) # expenses negative, income positive
+    return to_compact(chunk) # cents and categories, this also orders the columns like DATA_COLS
+
+# Create a function to read an uploaded CSV file chunk by chunk. Only one raw chunk is kept in memory at any time, the cleaned chunks are joined at the end,
+# so for a moment their columns exist twice (the text values are shared, not copied).
+# The required columns are checked against the header before any row is parsed. on_progress is called with the fraction of the file that was read.
+def load_csv_in_chunks(file, on_progress=None):
+    header = pd.read_csv(file, nrows=0).columns # read only the header line
+    required = [col for col in COLS_ORDER if col != "Select"] # all columns except "Select" are required
+    missing_cols = [col for col in required if col not in header] # if required column is not in the header, add it to the missing columns
+    if missing_cols:
+        raise ValueError("CSV is missing required columns: " + ", ".join(missing_cols))
+    usecols = required # ignore "Select" and any extra columns of the file
+    file_size = getattr(file, "size", None) # uploaded files know their size, this is used for the progress
+    file.seek(0) # go back to the start of the file after reading the header
+    cleaned_chunks = []
+    reader = pd.read_csv(file, usecols=usecols, dtype={col: CSV_DTYPES[col] for col in usecols}, chunksize=CSV_CHUNK_ROWS)
+    with reader:
+        for chunk in reader:
+            cleaned_chunks.append(clean_csv_chunk(chunk)) # the raw chunk is released as soon as it is cleaned
+            if on_progress is not None and file_size:
+                on_progress(min(file.tell() / file_size, 1.0))
+    if not cleaned_chunks: # the file only contains a header
+        return pd.DataFrame(columns=DATA_COLS)
+    return concat_compact(cleaned_chunks).reset_index(drop=True)
+
+# Create functions to compute the first and last day of the time spans that can be selected in the sidebar.
+def week_span(year, week):
+    return pd.Timestamp.fromisocalendar(year, week, 1), pd.Timestamp.fromisocalendar(year, week, 7) # Monday and Sunday of an ISO week
+
+def month_span(year, month):
+    start = pd.Timestamp(year=year, month=month, day=1)
+    return start, start + pd.offsets.MonthEnd(1) # first and last day of the month
+
+def year_span(year):
+    return pd.Timestamp(year=year, month=1, day=1), pd.Timestamp(year=year, month=12, day=31)
+
+def custom_span(first_day, last_day):
+    return pd.to_datetime(first_day), pd.to_datetime(last_day)
+
+# Create a function to get the rows of a date-sorted DataFrame from the start day up to and including the whole end day (start <= Date < end + 1 day).
+# The rows and the cube (dates at midnight) are cut with the same bounds, so the metrics and charts count exactly the rows of the table.
+# Because the dates are sorted, the boundaries are found with a binary search (searchsorted) and the result is a slice, not a copy.
+def slice_time_span(data, start, end):
+    first = data["Date"].searchsorted(start.normalize(), side="left") # position of the first row on or after the start day
+    last = data["Date"].searchsorted(end.normalize() + pd.Timedelta(days=1), side="left") # position after the last row of the end day
+    return data.iloc[first:last]
+
+# Create a function to add rows to a date-sorted DataFrame and keep it sorted.
+# A stable sort of two sorted runs is a single merge pass, so this is much cheaper than sorting the whole DataFrame again.
+def insert_sorted(data, rows):
+    combined = concat_compact([data, rows.sort_values("Date", kind="stable")])
+    return combined.take(combined["Date"].argsort(kind="stable"))
+
+# Define the columns of the aggregate cube. The cube holds the daily sums of the amounts for every combination of these columns.
+CUBE_DIMS = ["Type", "Category", "Project", "Payment Method", "Currency"]
+
+# Create a function to build the aggregate cube of some rows: one row per day and combination of CUBE_DIMS, sorted by date.
+# "Cents" is the sum of the amounts, "Count" is the number of entries in a cell, it tells when a cell becomes empty after a delete.
+def build_cube(rows):
+    keys = [rows["Date"].dt.normalize()] + [rows[dim] for dim in CUBE_DIMS] # day of the entry and the group columns
+    cube = rows.groupby(keys, dropna=False, sort=True, observed=True)["Cents"].agg(["sum", "size"]) # missing groups (e.g. no project) are kept as their own group
+    return cube.set_axis(["Cents", "Count"], axis=1).reset_index()
+
+# Create a function to add (sign=1) or remove (sign=-1) rows from the aggregate cube. Only the cells of the changed rows are touched,
+# the work depends on the size of the cube (days x groups) and not on the number of entries.
+def update_cube(cube, rows, sign=1):
+    delta = build_cube(rows)
+    delta[["Cents", "Count"]] *= sign
+    cube = concat_compact([cube, delta]).groupby(["Date"] + CUBE_DIMS, dropna=False, sort=True, observed=True, as_index=False)[["Cents", "Count"]].sum()
+    return cube[cube["Count"] != 0].reset_index(drop=True) # drop the cells that have no entries anymore
+
+# Create a function to sum up the income and the expenses of a cube (e.g. the cube of the selected time span).
+def cube_totals(cube):
+    total_income = cube.loc[cube["Type"] == "Income", "Cents"].sum() / 100 # the cube sums whole cents
+    total_expense = cube.loc[cube["Type"] == "Expense", "Cents"].sum() / 100
+    return total_income, total_expense
+
+# Create a function to get the data of the bar charts: the daily amounts per group, sorted by date within each group.
+def bar_chart_data(cube, group_by):
+    bar_data = cube.groupby([group_by, "Date"], dropna=False, sort=False, observed=True, as_index=False)["Cents"].sum() # the cube is already sorted by date
+    bar_data["Amount"] = bar_data["Cents"] / 100 # whole cents back to amounts
+    return bar_data
+
+# Create a function to get the data of the pie chart: the total amount per group.
+def pie_chart_data(cube, group_by):
+    pie_data = cube.groupby(group_by, observed=True, as_index=False)["Cents"].sum()
+    pie_data["Amount"] = pie_data["Cents"] / 100 # whole cents back to amounts
+    return pie_data
+
+# Create a function to cut a compact DataFrame into chunks of chunk_rows rows (slices, no copies)
+def iter_row_chunks(df, chunk_rows=EXPORT_CHUNK_ROWS):
+    for pos in range(0, len(df), chunk_rows):
+        yield df.iloc[pos:pos + chunk_rows]
+
+# Create a function to write compact chunks into an export file in one of the EXPORT_FORMATS, in the same layout that can be imported (COLS_ORDER).
+# Every chunk is converted and written on its own, so the export never has to be in memory as one big string.
+def write_export(chunks, path, fmt):
+    if fmt == "Parquet":
+        with pq.ParquetWriter(path, PARQUET_SCHEMA) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pandas(to_display(chunk), schema=PARQUET_SCHEMA, preserve_index=False))
+        return path
+    if fmt == "CSV (gzip)":
+        file = gzip.open(path, "wt", encoding="utf-8", newline="", compresslevel=EXPORT_GZIP_LEVEL)
+    else:
+        file = open(path, "w", encoding="utf-8", newline="")
+    with file:
+        header = True # the header is only written with the first chunk
+        for chunk in chunks:
+            to_display(chunk).to_csv(file, index=False, header=header)
+            header = False
+        if header: # no rows at all, write the header only
+            pd.DataFrame(columns=COLS_ORDER).to_csv(file, index=False)
+    return path
+
+# Create a function to convert the values the table returns for one column (e.g. dates as text) into the type of that column.
+def coerce_column(values, col):
+    if col == "Date":
+        return pd.to_datetime(values, errors="coerce")
+    if col == "Amount":
+        return pd.to_numeric(values, errors="coerce")
+    if col == "Select":
+        return values.fillna(False).astype(bool)
+    return values
+
+
+class LoadedLedger:
+    # The part of the ledger the app works with: the rows of the loaded years (compact layout, sorted by "Date"), their aggregate cube
+    # and the ids of the selected rows. The full history stays in the LedgerStore, which is shared by all sessions: is_stale() tells
+    # if another session changed it since the rows were loaded. Changes of this session go through append/update/delete.
+    def __init__(self):
+        self.data = pd.DataFrame(columns=DATA_COLS)
+        self.cube = None
+        self.years = None # (first year, last year) of the loaded rows, None if nothing is loaded
+        self.selected_ids = set()
+        self.version = 0 # counts the changes of the cube, results computed from the cube are cached per version
+        self.store_version = None # store.version the loaded rows are up to date with, None if nothing is loaded
+        self._converted = {} # cubes converted into a reporting currency, by (version, currency, rates)
+
+    # Load all rows of the given years (first year, last year) from the store and aggregate them once.
+    def load(self, store, years):
+        self.store_version = store.version # read before the rows, a change in between makes the ledger stale instead of being missed
+        data = store.load_span(pd.Timestamp(year=years[0], month=1, day=1), pd.Timestamp(year=years[1] + 1, month=1, day=1)) # sorted by date
+        self.data = to_compact(data) # categories for the columns with few different values
+        self.cube = build_cube(self.data) # afterwards the cube is only updated by the changes
+        self.years = years
+        self.version += 1
+
+    # Check if the store was changed since the rows were loaded, by another session or behind the back of this ledger
+    def is_stale(self, store):
+        return self.store_version != store.version
+
+    # Run one change of the store (write() changes it once). If nobody else changed the store at the same time, the loaded rows stay up to date
+    # once this ledger applied the change itself, otherwise the ledger becomes stale and is loaded again.
+    def _write(self, store, write):
+        before = store.version
+        result = write()
+        if self.store_version == before and store.version == before + 1:
+            self.store_version = store.version
+        return result
+
+    # Add new rows (compact layout) to the store and to the loaded rows. Returns their ids.
+    def append(self, store, rows):
+        rows = rows.copy(deep=False)
+        rows.index = self._write(store, lambda: store.append(rows)) # the index holds the ids of the rows in the store
+        self.add_rows(rows)
+        return rows.index
+
+    # Save new values of existing rows (index = ids) in the store and in the loaded rows
+    def update(self, store, rows):
+        self._write(store, lambda: store.update(rows))
+        self.replace_rows(rows)
+
+    # Delete the rows with the given ids from the store and from the loaded rows
+    def delete(self, store, ids):
+        self._write(store, lambda: store.delete(ids))
+        self.remove_rows(ids)
+
+    # Get the rows and the cube cells of the days from start to end (both included)
+    def visible(self, start, end):
+        return slice_time_span(self.data, start, end), slice_time_span(self.cube, start, end)
+
+    # Get the cube of all loaded years with the amounts converted into currency. The conversion runs once per (ledger version, currency, rates_key),
+    # switching the time span only slices the converted cube. rates_key tells different versions of the rate file apart (e.g. its modification time).
+    def converted_cube(self, rates, currency, rates_key=None):
+        key = (self.version, currency, rates_key)
+        if key not in self._converted:
+            self._converted = {old_key: cube for old_key, cube in self._converted.items() if old_key[0] == self.version} # the others are outdated
+            self._converted[key] = convert_cube(self.cube, rates, currency)
+        return self._converted[key]
+
+    # Add rows (compact layout, index = ids). Rows outside of the loaded years are only kept in the store.
+    def add_rows(self, rows):
+        if self.years is None: # nothing is loaded yet, the rows are read with the next load
+            return
+        rows = rows[rows["Date"].dt.year.between(self.years[0], self.years[1])]
+        self.data = insert_sorted(self.data, rows)
+        self.cube = update_cube(self.cube, rows, sign=1)
+        self.version += 1
+
+    # Remove the rows with the given ids, their current values are taken out of the cube.
+    def remove_rows(self, ids):
+        old_rows = self.data.loc[self.data.index.intersection(ids)]
+        self.data = self.data.drop(old_rows.index)
+        self.cube = update_cube(self.cube, old_rows, sign=-1)
+        self.version += 1
+        self.selected_ids.difference_update(old_rows.index)
+
+    # Replace rows by their new values (same ids), they are moved to their new place if the date changed.
+    def replace_rows(self, new_rows):
+        old_rows = self.data.loc[self.data.index.intersection(new_rows.index)]
+        self.data = self.data.drop(old_rows.index)
+        self.cube = update_cube(self.cube, old_rows, sign=-1)
+        self.version += 1
+        self.add_rows(new_rows)
+
+    # Save the changes made in the table. changes is the change set of st.data_editor ({"edited_rows", "added_rows", "deleted_rows"}),
+    # display_data is the DataFrame the table was showing. Only the changed rows are written to the store, in one batch per kind of change.
+    # Returns True if the ledger changed, False if only the selection changed.
+    def apply_editor_changes(self, changes, display_data, store):
+        ledger_changed = False
+
+        # deleted rows: the table reports their positions in display_data
+        deleted_ids = display_data.index[[int(pos) for pos in changes.get("deleted_rows", [])]]
+        if len(deleted_ids) > 0:
+            self.delete(store, deleted_ids) # Delete the rows from the database and from the loaded data and the cube
+            ledger_changed = True
+
+        # edited rows: {position: {column: new value}}, all changes are applied column by column to a copy of the changed rows
+        edited = {display_data.index[int(pos)]: values for pos, values in changes.get("edited_rows", {}).items()}
+        edited = {row_id: values for row_id, values in edited.items() if row_id not in deleted_ids}
+        if edited:
+            new_rows = display_data.loc[list(edited)].copy()
+            for col in display_data.columns:
+                cells = pd.Series({row_id: values[col] for row_id, values in edited.items() if col in values}, dtype=object)
+                if not cells.empty:
+                    new_rows.loc[cells.index, col] = coerce_column(cells, col)
+            self.selected_ids = (self.selected_ids - set(new_rows.index[~new_rows["Select"]])) | set(new_rows.index[new_rows["Select"]]) # the selection is not saved in the data
+            ledger_ids = [row_id for row_id, values in edited.items() if set(values) - {"Select"}] # rows where more than the "Select" checkbox changed
+            if ledger_ids:
+                changed_rows = to_compact(normalize_amount_signs(new_rows.loc[ledger_ids].copy())) # expenses negative, income positive, then cents and categories
+                self.update(store, changed_rows) # Save all changed rows in the database at once, update the cube and keep the data sorted by date
+                ledger_changed = True
+
+        # added rows: a list of {column: value}
+        if changes.get("added_rows"):
+            new_rows = pd.DataFrame(changes["added_rows"], columns=COLS_ORDER)
+            for col in COLS_ORDER:
+                new_rows[col] = coerce_column(new_rows[col], col)
+            new_rows = to_compact(normalize_amount_signs(new_rows)) # expenses negative, income positive, then cents and categories
+            self.append(store, new_rows) # Add the new rows to the database and to the loaded data
+            ledger_changed = True
+
+        return ledger_changed
+
+
+class ExportCache:
+    # Export files that were already written, keyed by (ledger version, format, rows). A file is reused until the ledger changes.
+    # The files of older ledger versions (and the oldest files beyond EXPORT_CACHE_FILES) are no longer reused after the next export
+    # and deleted EXPORT_KEEP_SECONDS later. The cache is shared between sessions, so it is locked, but only to look up and register files:
+    # a file is written outside the lock, so the other sessions don't have to wait for it.
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.files = {}
+        self.retired = [] # (time it was retired, path) of the files that are no longer reused
+        self.writing = {} # key -> threading.Event of the exports that are being written, set when the file is ready
+        self._lock = threading.Lock()
+
+    # Get the file of an export that was already written, or None. A file that was deleted in the meantime is forgotten, so it is written again.
+    def get(self, key):
+        with self._lock:
+            path = self.files.get(key)
+            if path is not None and not path.exists():
+                del self.files[key]
+                return None
+            return path
+
+    # Write the export for key = (version, format, rows) from the chunks that make_chunks() returns and remember the file.
+    # If another session is writing the same export, wait for its file instead of writing it a second time.
+    def write(self, key, make_chunks):
+        while True:
+            with self._lock:
+                path = self.files.get(key)
+                if path is not None and path.exists():
+                    return path
+                in_flight = self.writing.get(key)
+                if in_flight is None:
+                    ready = self.writing[key] = threading.Event() # this session writes the file
+                    break
+            in_flight.wait() # the file of the other session is used (or written here, if writing it failed)
+        path = self.directory / f"export_{uuid.uuid4().hex}{EXPORT_FORMATS[key[1]][0]}"
+        try:
+            path = write_export(make_chunks(), path, key[1]) # convert and write the rows, without holding the lock
+            with self._lock:
+                self._register(key, path)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        finally:
+            with self._lock:
+                del self.writing[key]
+            ready.set()
+        return path
+
+    # Remember the finished file of key and retire the files it replaces. Must be called with the lock held.
+    def _register(self, key, path):
+        outdated = [old_key for old_key in self.files if old_key[0] < key[0]] # the ledger has changed since these files were written
+        outdated += [old_key for old_key in self.files if old_key not in outdated][:max(0, len(self.files) - len(outdated) - EXPORT_CACHE_FILES + 1)] # oldest first
+        now = time.monotonic()
+        self.retired += [(now, self.files.pop(old_key)) for old_key in outdated]
+        for retired_at, old_path in self.retired:
+            if now - retired_at > EXPORT_KEEP_SECONDS:
+                old_path.unlink(missing_ok=True)
+        self.retired = [(retired_at, old_path) for retired_at, old_path in self.retired if now - retired_at <= EXPORT_KEEP_SECONDS]
+        self.files[key] = path
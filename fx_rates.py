@@ -0,0 +1,77 @@
+# -----------------------------------------------------------------------------
+# Exchange rates of BudgetBuddy.
+# The rates are read from a local CSV file with one row per day and currency: Date, Currency, Rate.
+# Rate is the value of one unit of the currency in FX_BASE_CURRENCY (e.g. 2025-05-01, EUR, 0.94 means 1 EUR = 0.94 CHF).
+# Days without a rate use the last rate before them (an as-of join), so the file only needs the days the rates were published.
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import pandas as pd
+
+# Define the default location of the rate file and the currency the rates are quoted in (it has the rate 1 and needs no rows)
+DEFAULT_FX_PATH = "fx_rates.csv"
+FX_BASE_CURRENCY = "CHF"
+FX_COLS = ["Date", "Currency", "Rate"]
+
+
+# Create a function to bring currency codes into one spelling ("eur " -> "EUR"). Missing codes become "".
+def normalize_currency(codes):
+    return codes.astype(object).where(codes.notna(), "").astype(str).str.strip().str.upper()
+
+
+# Create a function to read the rate file. Returns the rates sorted by date, with the day in "Date".
+def load_fx_rates(path=DEFAULT_FX_PATH):
+    header = pd.read_csv(path, nrows=0).columns # read only the header line
+    missing_cols = [col for col in FX_COLS if col not in header]
+    if missing_cols:
+        raise ValueError("FX rate file is missing required columns: " + ", ".join(missing_cols))
+    rates = pd.read_csv(path, usecols=FX_COLS, dtype={"Currency": str, "Rate": "float64"})
+    rates["Date"] = pd.to_datetime(rates["Date"], errors="coerce").dt.normalize().astype("datetime64[ns]") # the same date type as the ledger
+    rates["Currency"] = normalize_currency(rates["Currency"])
+    rates = rates[rates["Date"].notna() & (rates["Rate"] > 0) & (rates["Currency"] != "")] # skip rows that can't be used
+    return rates.sort_values("Date", kind="stable").reset_index(drop=True)
+
+
+# Create a function to get the currencies that amounts can be converted into
+def fx_currencies(rates):
+    return sorted(set(rates["Currency"]) | {FX_BASE_CURRENCY})
+
+
+# Create a function to look up the rate of every (date, currency) pair with an as-of join: the last rate on or before the date.
+# Dates before the first rate of a currency use its first rate. Currencies without any rate get NaN. dates must be sorted.
+def rates_as_of(dates, currencies, rates):
+    left = pd.DataFrame({"Date": dates.to_numpy(dtype="datetime64[ns]"), "Currency": currencies.to_numpy()})
+    found = pd.merge_asof(left, rates, on="Date", by="Currency", direction="backward")["Rate"] # one vectorized join over all pairs, in the order of left
+    if found.isna().any():
+        later = pd.merge_asof(left, rates, on="Date", by="Currency", direction="forward")["Rate"]
+        found = found.fillna(later)
+    found[left["Currency"].to_numpy() == FX_BASE_CURRENCY] = 1.0
+    return found.to_numpy()
+
+
+# Create a function to convert the amounts of an aggregate cube (daily sums per currency, sorted by date) into currency.
+# Because the rates are daily, converting the daily sums gives the same result as converting every entry, for much fewer rows.
+# Cells without a currency are taken as they are. Cells in a currency without rates get a missing amount, so they are left out of the sums.
+def convert_cube(cube, rates, currency):
+    converted = cube.copy()
+    if cube.empty:
+        return converted
+    codes = normalize_currency(cube["Currency"])
+    rate_from = rates_as_of(cube["Date"], codes, rates) # value of one unit of the cell's currency in FX_BASE_CURRENCY
+    rate_to = rates_as_of(cube["Date"], pd.Series(currency, index=cube.index), rates) # value of one unit of the reporting currency
+    factor = pd.Series(rate_from / rate_to, index=cube.index).where((codes != "").to_numpy(), 1.0) # no currency: keep the amount
+    converted["Cents"] = cube["Cents"] * factor # cents in the reporting currency, not rounded per cell so the sums don't drift
+    return converted
+
+
+# Create a function to find the cells of a cube that could not be converted (no rates). cube and converted have the same index.
+def _lost_cells(cube, converted):
+    return converted["Cents"].isna() & cube["Cents"].notna() # cells that had an amount before the conversion
+
+# Create a function to list the currencies of a cube that could not be converted (no rates)
+def unconverted_currencies(cube, converted):
+    return sorted(normalize_currency(converted.loc[_lost_cells(cube, converted), "Currency"]).unique())
+
+# Create a function to leave the cells that could not be converted out of a converted cube, so they don't show up as empty groups in the charts
+def drop_unconverted(cube, converted):
+    return converted[~_lost_cells(cube, converted)]
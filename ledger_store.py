@@ -0,0 +1,178 @@
+# -----------------------------------------------------------------------------
+# Storage backend of BudgetBuddy.
+# The ledger is kept in a local SQLite file so it survives the end of a session. The "Date" column is indexed,
+# which allows the app to load only the rows of the selected time span instead of the full history.
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import sqlite3
+import threading
+from contextlib import closing
+
+import pandas as pd
+
+# Define the columns that are stored. "Select" is only used by the table in the app and is not saved.
+# Amounts are stored as whole cents ("Cents"), so sums don't drift like floating point amounts do.
+LEDGER_COLS = ["Date", "Name", "Description", "Cents", "Category", "Type", "Currency", "Payment Method", "Project"]
+
+# Define the default location of the database file
+DEFAULT_DB_PATH = "budgetbuddy.db"
+
+# Dates are stored as seconds since 1970-01-01, integers compare much faster than date strings
+EPOCH = pd.Timestamp(0)
+
+# Define the columns that identify a transaction. When statements are imported, rows with the same values in these columns are the same transaction.
+# A hash of them is stored in the "Key" column of every row.
+KEY_COLS = ["Date", "Name", "Cents", "Currency", "Payment Method"]
+
+# Number of rows written to the database per executemany call
+WRITE_BATCH_ROWS = 50_000
+
+# Number of rows read per chunk when the ledger is read in chunks (e.g. for the export)
+READ_CHUNK_ROWS = 100_000
+
+_COLS_SQL = ", ".join(f'"{col}"' for col in LEDGER_COLS) # quoted column names, "Payment Method" contains a space
+_WRITE_COLS = LEDGER_COLS + ["Key"] # the columns that are written, "Key" is computed from the others
+_WRITE_COLS_SQL = ", ".join(f'"{col}"' for col in _WRITE_COLS)
+_PLACEHOLDERS_SQL = ", ".join("?" for _ in _WRITE_COLS)
+
+_CREATE_SQL = """
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    "Date" INTEGER,
+    "Name" TEXT,
+    "Description" TEXT,
+    "Cents" INTEGER,
+    "Category" TEXT,
+    "Type" TEXT,
+    "Currency" TEXT,
+    "Payment Method" TEXT,
+    "Project" TEXT,
+    "Key" INTEGER
+);
+CREATE INDEX IF NOT EXISTS ledger_date ON ledger ("Date");
+"""
+
+
+# Create a function to convert a date column into seconds since 1970 (missing dates stay missing)
+def dates_to_epoch(dates):
+    dates = pd.to_datetime(dates, errors="coerce")
+    return ((dates - EPOCH).dt.total_seconds()).round().astype("Int64")
+
+
+# Create a function to convert seconds since 1970 back into a date column
+def epoch_to_dates(seconds):
+    return pd.to_datetime(seconds, unit="s")
+
+
+# Create a function to compute the key of every row: a 64 bit hash of the KEY_COLS (stored as a signed integer, like SQLite stores integers).
+# Text and categorical columns give the same hash for the same values, so rows from an import and rows from the database can be compared.
+def row_keys(df):
+    keys = df[KEY_COLS].copy()
+    keys["Date"] = dates_to_epoch(keys["Date"]) # whole seconds, like the stored dates
+    return pd.util.hash_pandas_object(keys, index=False).astype("int64")
+
+
+# Create a function to turn a DataFrame into rows that sqlite3 can write (NaN/NaT become NULL)
+def _to_records(df):
+    out = df[LEDGER_COLS].copy()
+    out["Key"] = row_keys(df)
+    out["Date"] = dates_to_epoch(out["Date"])
+    out = out.astype(object).where(out.notna(), None)
+    return list(out.itertuples(index=False, name=None))
+
+
+# Create a function to read the result of a query into a DataFrame indexed by the row id
+def _read_frame(conn, where="", params=()):
+    return _finish_frame(pd.read_sql_query(f"SELECT id, {_COLS_SQL} FROM ledger {where}", conn, params=params, index_col="id"))
+
+
+# Create a function to convert the columns of a DataFrame read from the database into the types of the app
+def _finish_frame(df):
+    df["Date"] = epoch_to_dates(df["Date"])
+    df["Cents"] = df["Cents"].astype("Int64") # whole cents, missing amounts stay missing
+    df.index.name = None
+    return df
+
+
+class LedgerStore:
+    # The store opens a short-lived connection for every call, so it can be shared between Streamlit sessions and threads.
+    def __init__(self, path=DEFAULT_DB_PATH):
+        self.path = path
+        self.version = 0 # counts the changes made through this store (after they are committed), results that depend on the ledger (e.g. loaded rows, exports) are checked against it
+        self._version_lock = threading.Lock() # the store is shared by all sessions, every change must count
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executescript(_CREATE_SQL)
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path))
+
+    # Load all rows with start <= Date < end, sorted by date. The index of the result holds the row ids.
+    def load_span(self, start, end):
+        with self._connect() as conn:
+            return _read_frame(conn, 'WHERE "Date" >= ? AND "Date" < ? ORDER BY "Date", id', (int((start - EPOCH).total_seconds()), int((end - EPOCH).total_seconds())))
+
+    # Count one committed change
+    def _changed(self):
+        with self._version_lock:
+            self.version += 1
+
+    # Read the complete ledger in the order the rows were added, in chunks of chunk_rows rows, so it never has to be in memory as a whole
+    def iter_chunks(self, chunk_rows=READ_CHUNK_ROWS):
+        with self._connect() as conn:
+            for chunk in pd.read_sql_query(f"SELECT id, {_COLS_SQL} FROM ledger ORDER BY id", conn, index_col="id", chunksize=chunk_rows):
+                yield _finish_frame(chunk)
+
+    # Count the stored rows per key with start <= Date <= end (and the rows without a date). The result maps each key to its number of rows.
+    def key_counts(self, start, end):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT "Key", COUNT(*) FROM ledger WHERE ("Date" >= ? AND "Date" <= ?) OR "Date" IS NULL GROUP BY "Key"',
+                                (int((start - EPOCH).total_seconds()), int((end - EPOCH).total_seconds()))).fetchall()
+        return pd.Series(dict(rows), dtype="int64")
+
+    # Append new rows and return the ids they were stored under (in the same order as df)
+    def append(self, df):
+        with self._connect() as conn, conn:
+            ids = self._insert(conn, df)
+        self._changed()
+        return ids
+
+    def _insert(self, conn, df):
+        first_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM ledger").fetchone()[0] # without AUTOINCREMENT, SQLite hands out MAX(id) + 1
+        ids = range(first_id, first_id + len(df))
+        for pos in range(0, len(df), WRITE_BATCH_ROWS): # write large imports in batches, only one batch is converted into Python rows at a time
+            records = _to_records(df.iloc[pos:pos + WRITE_BATCH_ROWS])
+            batch = [(row_id,) + record for row_id, record in zip(ids[pos:pos + WRITE_BATCH_ROWS], records)]
+            conn.executemany(f"INSERT INTO ledger (id, {_WRITE_COLS_SQL}) VALUES (?, {_PLACEHOLDERS_SQL})", batch)
+        return pd.Index(ids)
+
+    # Overwrite the rows whose ids are in the index of df with the values of df
+    def update(self, df):
+        if df.empty:
+            return
+        assignments = ", ".join(f'"{col}" = ?' for col in _WRITE_COLS)
+        records = [record + (int(row_id),) for record, row_id in zip(_to_records(df), df.index)]
+        with self._connect() as conn, conn:
+            conn.executemany(f"UPDATE ledger SET {assignments} WHERE id = ?", records)
+        self._changed()
+
+    # Delete the rows with the given ids
+    def delete(self, ids):
+        records = [(int(row_id),) for row_id in ids]
+        with self._connect() as conn, conn:
+            conn.executemany("DELETE FROM ledger WHERE id = ?", records)
+        self._changed()
+
+    # Replace the whole ledger with df in one transaction (the app appends imported rows, this is used to fill a database for the benchmarks and checks)
+    def replace_all(self, df):
+        with self._connect() as conn, conn:
+            conn.execute("DELETE FROM ledger")
+            ids = self._insert(conn, df)
+        self._changed()
+        return ids
+
+    # Delete every row of the ledger
+    def reset(self):
+        with self._connect() as conn, conn:
+            conn.execute("DELETE FROM ledger")
+        self._changed()
@@ -0,0 +1,131 @@
+# -----------------------------------------------------------------------------
+# Instrumentation of BudgetBuddy reruns.
+# Every rerun of the script is split into stages (loading, filtering, table, charts, ...). When measuring is switched on,
+# the time of each stage is recorded together with the number of rows and the memory of the DataFrame it worked on.
+# The records can be shown in the app and appended to a JSON lines log file, one line per rerun, to compare many sessions.
+# When measuring is switched off, a stage costs one function call and nothing is recorded.
+# Run: python rerun_profiler.py <log.jsonl> to summarize a log file.
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import json
+import sys
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+# Define the default location of the log file
+DEFAULT_LOG_PATH = "budgetbuddy_reruns.jsonl"
+
+
+class _Stage:
+    # Measurements of one stage. observe(df) remembers the DataFrame the stage produced, its size is only calculated when the rerun is finished.
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.frame = None
+
+    def observe(self, frame):
+        self.frame = frame
+
+    def to_record(self):
+        record = {"stage": self.name, "seconds": round(self.seconds, 6), "rows": None, "memory_mb": None}
+        if self.frame is not None:
+            record["rows"] = len(self.frame)
+            record["memory_mb"] = round(self.frame.memory_usage(index=True, deep=True).sum() / 1e6, 3) # deep: also count the text in object columns
+        return record
+
+
+class _NoStage:
+    # Stand-in for _Stage while measuring is switched off, observe(df) does nothing
+    def observe(self, frame):
+        pass
+
+
+_NO_STAGE = nullcontext(_NoStage()) # shared by all stages while measuring is switched off, so nothing is created per call
+
+
+class RerunProfiler:
+    # Collects the stages of the current rerun. It is kept in st.session_state, so stages that run in widget callbacks
+    # (before the script itself) are counted to the rerun they trigger.
+    def __init__(self):
+        self.enabled = False
+        self.log_path = None # append every finished rerun to this file, None to keep the records only in memory
+        self.session_id = uuid.uuid4().hex[:8] # tells the sessions apart in a shared log file
+        self.rerun = 0
+        self.last = None # record of the last finished rerun, shown in the app
+        self._stages = []
+        self._started = None
+
+    # Start measuring a rerun. Stages recorded since the last finished rerun (callbacks, or a rerun stopped by st.rerun()) are kept.
+    def start(self, enabled, log_path=None):
+        self.enabled = enabled
+        self.log_path = log_path
+        if not enabled:
+            self._stages = []
+        self._started = time.perf_counter()
+
+    # Time the code in the with block as one stage: with profiler.stage("filter") as stage: ... stage.observe(df)
+    def stage(self, name):
+        if not self.enabled:
+            return _NO_STAGE
+        return self._measure(name)
+
+    @contextmanager
+    def _measure(self, name):
+        stage = _Stage(name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.seconds = time.perf_counter() - start
+            self._stages.append(stage)
+
+    # Finish the rerun: turn the stages into a record, write it to the log file and keep it for the panel
+    def finish(self):
+        if not self.enabled:
+            return None
+        self.rerun += 1
+        stages = [stage.to_record() for stage in self._stages]
+        script_seconds = time.perf_counter() - self._started
+        self.last = {
+            "time": pd.Timestamp.now().isoformat(timespec="seconds"),
+            "session": self.session_id,
+            "rerun": self.rerun,
+            "seconds": round(script_seconds, 6), # the whole script, stages included (callback stages are not part of it)
+            "stages": stages,
+        }
+        self._stages = []
+        if self.log_path:
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(json.dumps(self.last) + "\n")
+        return self.last
+
+
+# Create a function to turn the record of one rerun into a table (one row per stage)
+def rerun_table(record):
+    table = pd.DataFrame(record["stages"], columns=["stage", "seconds", "rows", "memory_mb"])
+    table["ms"] = table.pop("seconds") * 1000
+    table["rows"] = table["rows"].astype("Int64") # stages that don't observe a DataFrame have no rows
+    return table[["stage", "ms", "rows", "memory_mb"]]
+
+
+# Create a function to summarize a log file: number of measurements, median, 95th percentile and maximum time per stage
+def summarize_log(path):
+    with open(path, encoding="utf-8") as log_file:
+        records = [json.loads(line) for line in log_file if line.strip()]
+    stages = pd.DataFrame([stage | {"session": record["session"]} for record in records for stage in record["stages"]])
+    reruns = pd.DataFrame({"stage": "(rerun)", "seconds": [record["seconds"] for record in records], "session": [record["session"] for record in records]})
+    times = pd.concat([stages, reruns], ignore_index=True)
+    times["ms"] = times["seconds"] * 1000
+    summary = times.groupby("stage", sort=False)["ms"].agg(count="count", median="median", p95=lambda ms: ms.quantile(0.95), max="max")
+    summary["sessions"] = times.groupby("stage", sort=False)["session"].nunique()
+    return summary.sort_values("median", ascending=False)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python rerun_profiler.py <log.jsonl>")
+    print(summarize_log(sys.argv[1]).round(1).to_string())
@@ -0,0 +1,131 @@
+# -----------------------------------------------------------------------------
+# Import of bank statements (CSV files) into BudgetBuddy.
+# Several files are parsed at the same time in separate processes, so a batch of statements takes about as long as the largest file.
+# Parsed files are cached by a hash of their content, so uploading the same file again (in any session) does not parse it again.
+# Before the rows are added, transactions that are already in the ledger are removed (see ledger_store.KEY_COLS).
+# -----------------------------------------------------------------------------
+
+# Import libraries
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from budget_core import DATA_COLS, concat_compact, load_csv_in_chunks
+from ledger_store import row_keys
+
+# Define how many parsed rows the cache keeps (the least recently used files are dropped first)
+PARSED_CACHE_ROWS = 5_000_000
+
+
+# Create a function to parse the content of one CSV file. It runs in a worker process, so it only gets and returns picklable values.
+# on_progress is called with the fraction of the file that is parsed (only when it runs in this process, a callback can't be sent to a worker).
+def parse_statement(content, on_progress=None):
+    file = io.BytesIO(content)
+    file.size = len(content) # like an uploaded file, so the progress can be calculated
+    return load_csv_in_chunks(file, on_progress)
+
+
+# Create a function to compute the hash a file is cached by
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+# Create a function to start the worker processes. "spawn" starts fresh interpreters, forking a multi-threaded server (like Streamlit) is not safe.
+def make_pool(workers=None):
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+
+class ParsedStatementCache:
+    # Parsed files (compact layout) by content hash. The cache is shared between sessions, so it is locked.
+    def __init__(self, max_rows=PARSED_CACHE_ROWS):
+        self.max_rows = max_rows
+        self.frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key) # most recently used
+            return frame
+
+    def put(self, key, frame):
+        with self._lock:
+            self.frames[key] = frame
+            self.frames.move_to_end(key)
+            while len(self.frames) > 1 and sum(len(cached) for cached in self.frames.values()) > self.max_rows:
+                self.frames.popitem(last=False) # drop the least recently used file
+
+
+# Create a function to parse several files: files is a list of (name, content). Files that are in the cache are not parsed again,
+# the others are parsed in parallel by the pool (or here, if there is only one). on_progress is called with the fraction of the files that are done.
+# A pool whose worker process died raises BrokenProcessPool, it can't be used again.
+# Returns the parsed files in the order of files. A file that can't be read raises a ValueError naming the file.
+def parse_statements(files, cache, pool=None, on_progress=None):
+    hashes = [content_hash(content) for _, content in files]
+    parsed = {key: cache.get(key) for key in hashes}
+    missing = {key: (name, content) for (name, content), key in zip(files, hashes) if parsed[key] is None} # the same file uploaded twice is parsed once
+    done = len(files) - len(missing)
+
+    def finish(key, frame):
+        nonlocal done
+        parsed[key] = frame
+        cache.put(key, frame)
+        done += 1
+        if on_progress is not None:
+            on_progress(done / len(files))
+
+    if pool is None or len(missing) == 1: # no need to hand a single file to another process
+        for key, (name, content) in missing.items():
+            on_file_progress = None
+            if on_progress is not None: # report the progress within the file, not only when it is finished
+                on_file_progress = lambda fraction: on_progress((done + fraction) / len(files))
+            try:
+                finish(key, parse_statement(content, on_file_progress))
+            except ValueError as e:
+                raise ValueError(f"{name}: {e}") from e
+    else:
+        futures = {pool.submit(parse_statement, content): (key, name) for key, (name, content) in missing.items()}
+        for future in as_completed(futures):
+            key, name = futures[future]
+            try:
+                finish(key, future.result())
+            except ValueError as e:
+                for other in futures:
+                    other.cancel()
+                raise ValueError(f"{name}: {e}") from e
+    return [parsed[key] for key in hashes]
+
+
+# Create a function to find the transactions of the parsed files that are not in the ledger yet. Returns (new rows, number of skipped rows).
+# Each row gets the number of rows before it with the same key in its file. A row is new if that number is at least the number of stored rows
+# with this key, and no other file has the same key and number. So overlapping statements add a transaction once, while two equal
+# transactions within one statement (e.g. two coffees on the same day) are both kept.
+def new_transactions(frames, store):
+    frames = [frame for frame in frames if len(frame) > 0]
+    if not frames:
+        return pd.DataFrame(columns=DATA_COLS), 0
+    incoming = concat_compact(frames).reset_index(drop=True)
+    keys = row_keys(incoming)
+    occurrence = pd.concat([key_part.groupby(key_part).cumcount() for key_part in _split(keys, frames)], ignore_index=True) # numbered within each file
+    first_of_pair = ~pd.DataFrame({"key": keys, "occurrence": occurrence}).duplicated() # the same transaction in an earlier file
+    dates = incoming["Date"].dropna()
+    first, last = (dates.min(), dates.max()) if len(dates) else (pd.Timestamp(0), pd.Timestamp(0))
+    stored = store.key_counts(first, last) # hash index of the stored rows of the same time span
+    stored_count = keys.map(stored).fillna(0)
+    is_new = first_of_pair & (occurrence >= stored_count)
+    return incoming[is_new].reset_index(drop=True), int((~is_new).sum())
+
+
+# Create a function to split a Series of all incoming rows back into the parts of the files
+def _split(values, frames):
+    start = 0
+    for frame in frames:
+        yield values.iloc[start:start + len(frame)]
+        start += len(frame)